@@ -54,8 +54,93 @@ value_ranges = {
     "angle": (0, 360),
     "other": (0, 100)
 }
+# 长按连续调整：按住时间达到各阈值(ms)后使用更大的步长
+REPEAT_STAGE_MS = (1000, 2000, 3000)
 
-rgb = neopixel.NeoPixel(machine.Pin(38), 10)
+
+# 按数值范围生成步长表，跨度越大步长增长越快
+def _build_step_table(min_val, max_val):
+    span = max_val - min_val
+    steps = [1]
+    for divisor in (200, 50, 10):
+        steps.append(max(steps[-1], span // divisor))
+    return tuple(steps)
+
+
+value_steps = {name: _build_step_table(low, high) for name, (low, high) in value_ranges.items()}
+
+
+def repeat_step(label, held_ms):
+    steps = value_steps.get(label.lower(), value_steps["other"])
+    stage = 0
+    for threshold in REPEAT_STAGE_MS:
+        if held_ms >= threshold:
+            stage += 1
+    return steps[stage]
+
+
+RGB_PIXELS = 10             # 灯珠数量
+RGB_MIN_WRITE_MS = 20       # 两次写灯带的最小间隔，刷新率不超过50Hz
+
+
+class RGB_STRIP:
+    """灯带帧缓冲：修改只写入缓冲区并标记，由渲染循环按限定频率一次写出整条灯带"""
+    def __init__(self, pin, count=RGB_PIXELS, min_write_ms=RGB_MIN_WRITE_MS):
+        self.np = neopixel.NeoPixel(pin, count)
+        self.count = count
+        self.colors = bytearray(3 * count)     # 各灯珠的原始颜色
+        self.levels = bytearray([100] * count)  # 各灯珠的亮度百分比
+        self.min_write_ms = min_write_ms
+        self.dirty = False
+        self.last_write = 0
+        self.writes = 0
+
+    def _check(self, start, end):
+        if not 0 <= start <= end <= self.count:
+            raise IndexError("灯珠编号超出范围")
+
+    def set_range(self, start, end, color, brightness=None):
+        """设置[start, end)范围内灯珠的颜色，brightness为亮度百分比，None表示保持不变"""
+        self._check(start, end)
+        for i in range(start, end):
+            self.colors[3 * i:3 * i + 3] = bytes(color)
+            if brightness is not None:
+                self.levels[i] = max(0, min(100, brightness))
+        self.dirty = True
+
+    def set(self, index, color, brightness=None):
+        self.set_range(index, index + 1, color, brightness)
+
+    def fill(self, color, brightness=None):
+        self.set_range(0, self.count, color, brightness)
+
+    def set_brightness(self, brightness, start=0, end=None):
+        end = self.count if end is None else end
+        self._check(start, end)
+        for i in range(start, end):
+            self.levels[i] = max(0, min(100, brightness))
+        self.dirty = True
+
+    def flush(self):
+        """有修改且距上次写入超过最小间隔时写出整条灯带，返回是否写入"""
+        if not self.dirty:
+            return False
+        now = time.ticks_ms()
+        if self.writes and time.ticks_diff(now, self.last_write) < self.min_write_ms:
+            return False
+        # 先清除标记，写出期间的新修改留到下一帧
+        self.dirty = False
+        colors = self.colors
+        for i in range(self.count):
+            level = self.levels[i]
+            self.np[i] = (colors[3 * i] * level // 100, colors[3 * i + 1] * level // 100, colors[3 * i + 2] * level // 100)
+        self.np.write()
+        self.last_write = now
+        self.writes += 1
+        return True
+
+
+rgb = RGB_STRIP(machine.Pin(38))
 pot = ADC(Pin(11))
 pot.atten(ADC.ATTN_11DB)    # 衰减设置范围：输入电压0-3.3v
 pot.width(ADC.WIDTH_12BIT)  # 读取的电压转为0-4096；ADC.WIDTH_9BIT：0-511
@@ -80,24 +165,127 @@ jingle = [E7, E7, E7, 0,
           F7, F7, F7, F7, F7, E7, E7, E7, G7, G7, F7, D7, C7, 0]
 
 
-# 获取按钮电压并转换为按钮值
-def get_button_ADC():
-    pot_value = pot.read()  # 读取ADC值
-    time.sleep(0.01)
-    VCC = pot_value / 4096 * 3.3  # 将ADC值转换为电压
-    # 定义电压范围和对应按钮值的映射
-    voltage_to_button = {
-        (0.5, 0.7): 2,
-        (1.2, 1.4): 3,
-        (1.6, 1.7): 4,
-        (1.8, 2.1): 5,
-        (2.1, 2.4): 6,
-    }
-    # 遍历字典，判断电压在哪个范围内
+# 定义电压范围和对应按钮值的映射
+voltage_to_button = {
+    (0.5, 0.7): 2,
+    (1.2, 1.4): 3,
+    (1.6, 1.7): 4,
+    (1.8, 2.1): 5,
+    (2.1, 2.4): 6,
+}
+
+
+# 预先计算 ADC值(0~4095) -> 按钮值 的查找表，读取时只需一次查表
+def _build_key_table():
+    table = bytearray(4096)
     for (low, high), button_value in voltage_to_button.items():
-        if low < VCC < high:
-            return button_value
-    if VCC == 0:
-        return 1
-    return 0
+        start = max(0, int(low * 4096 / 3.3) - 1)
+        end = min(4096, int(high * 4096 / 3.3) + 2)
+        for code in range(start, end):
+            if low < code / 4096 * 3.3 < high:
+                table[code] = button_value
+    table[0] = BUTTON_OK  # 电压为0时为确认键
+    return table
+
+
+KEY_TABLE = _build_key_table()
+
+KEY_PRESS = 1       # 按下
+KEY_RELEASE = 2     # 松开
+KEY_LONG_PRESS = 3  # 长按
+KEY_REPEAT = 4      # 长按后的连续触发
+KEY_SAMPLE_MS = 10          # 定时器采样周期
+KEY_DEBOUNCE_SAMPLES = 3    # 连续相同的采样次数达到后才认为按键状态稳定
+KEY_LONG_PRESS_MS = 600     # 长按判定时间
+KEY_REPEAT_MS = 50          # 长按后连续触发的间隔
+KEY_EVENT_SIZE = 16         # 事件队列容量
+
+
+class KEYPAD:
+    """硬件定时器采样ADC按键，去抖后生成按下/松开/长按事件放入环形队列"""
+    def __init__(self, adc, timer_id=0):
+        self.adc = adc
+        self.timer_id = timer_id
+        self.timer = None
+        self.key = 0          # 去抖后的当前按键
+        self.candidate = 0    # 正在确认的按键
+        self.stable = 0
+        self.press_time = 0
+        self.long_sent = False
+        self.next_repeat = 0
+        # 单生产者单消费者环形队列：定时器只移动tail，消费者只移动head，无需加锁
+        self.event_types = bytearray(KEY_EVENT_SIZE)
+        self.event_keys = bytearray(KEY_EVENT_SIZE)
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+    def start(self):
+        if self.timer is None:
+            self.timer = machine.Timer(self.timer_id)
+            self.timer.init(period=KEY_SAMPLE_MS, mode=machine.Timer.PERIODIC, callback=self._sample)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.deinit()
+            self.timer = None
 
+    def _push(self, event_type, key):
+        if self.tail - self.head >= KEY_EVENT_SIZE:
+            self.dropped += 1
+            return
+        index = self.tail % KEY_EVENT_SIZE
+        self.event_types[index] = event_type
+        self.event_keys[index] = key
+        self.tail += 1
+
+    def _sample(self, timer):
+        key = KEY_TABLE[self.adc.read()]
+        if key != self.candidate:
+            self.candidate = key
+            self.stable = 0
+        if self.stable < KEY_DEBOUNCE_SAMPLES:
+            self.stable += 1
+            if self.stable < KEY_DEBOUNCE_SAMPLES:
+                return
+        now = time.ticks_ms()
+        if key != self.key:
+            if self.key:
+                self._push(KEY_RELEASE, self.key)
+            self.key = key
+            self.press_time = now
+            self.long_sent = False
+            if key:
+                self._push(KEY_PRESS, key)
+        elif key and not self.long_sent and time.ticks_diff(now, self.press_time) >= KEY_LONG_PRESS_MS:
+            self.long_sent = True
+            self.next_repeat = time.ticks_add(now, KEY_REPEAT_MS)
+            self._push(KEY_LONG_PRESS, key)
+        elif key and self.long_sent and time.ticks_diff(now, self.next_repeat) >= 0:
+            self.next_repeat = time.ticks_add(now, KEY_REPEAT_MS)
+            self._push(KEY_REPEAT, key)
+
+    def get_event(self):
+        """取出一个事件，返回 (事件类型 << 4) | 按键值，队列为空时返回0"""
+        if self.head == self.tail:
+            return 0
+        index = self.head % KEY_EVENT_SIZE
+        event = (self.event_types[index] << 4) | self.event_keys[index]
+        self.head += 1
+        return event
+
+    def held_ms(self):
+        # 当前按键已按住的时间
+        if not self.key:
+            return 0
+        return time.ticks_diff(time.ticks_ms(), self.press_time)
+
+
+keypad = KEYPAD(pot)
+
+
+# 获取按钮电压并转换为按钮值
+def get_button_ADC():
+    if keypad.timer is not None:
+        return keypad.key  # 定时器采样运行时直接返回去抖后的按键
+    return KEY_TABLE[pot.read()]
@@ -1,11 +1,15 @@
 from machine import Pin, SPI
 from button import *
+from array import array
 import lvgl_esp32
 import lvgl as lv
 import bluetooth
 import zc_drive
 import _thread
+import asyncio
+import json
 import random
+import struct
 import time
 import math
 
@@ -25,18 +29,44 @@ except Exception as e:
     raise
 
 # 全局变量
-screens = []  # 存储所有主屏幕和子屏幕
+USE_ASYNCIO = False  # True: 使用asyncio协作式调度代替多线程
+screens = []  # 存储主屏幕
+SUB_SCREEN_CACHE_SIZE = 4  # 最多缓存的子屏幕数量
+TOAST_CACHE_SIZE = 8       # 最多缓存的提示屏幕数量
+sub_screen_cache = {}  # 子屏幕缓存 名称: [屏幕, 按钮列表, 传感器标签列表, 状态标签]
+sub_screen_order = []  # 子屏幕使用顺序，最近使用的在末尾
+toast_cache = {}       # 提示屏幕缓存 类型: [屏幕, 标签, 当前文字]
+toast_order = []
+toast_return = None  # 提示结束后返回的屏幕
+toast_deadline = 0
+BLE_START_DELAY_MS = 1000  # 进入BLE界面后先显示"Connecting..."，延迟启动蓝牙
+ble_start_deadline = None  # 计划启动蓝牙的时刻，由渲染循环到期后启动，None表示无计划
+current_sub_screen = None  # 当前子屏幕
+TEXT_STYLE_CACHE_SIZE = 8  # 文字样式缓存数量
+text_screen = None         # 蓝牙文字显示屏幕（0xF3），创建后一直复用
+text_label = None
+text_styles = {}           # 文字样式缓存 (字号, 颜色): 样式
+text_style_order = []
+text_style_current = None  # 文字标签当前使用的样式
+text_style_hits = 0
+text_style_misses = 0
 current_menu = "main"  # 当前界面类型 ("main" 或 "sub")
 current_index = 0  # 当前选中的按钮索引
 editing_mode = False  # 是否处于编辑模式
 # main_menu_buttons = None  # 主屏幕的按钮列表
 sub_menu_buttons = None  # 子屏幕的按钮列表
+sub_menu_pointer_buttons = None  # 子屏幕中可高亮的按钮
+pointer_list = None  # 当前高亮所在的按钮列表
+pointer_index = -1   # 当前高亮的按钮索引
+label_values = {}    # 各标签最近一次显示的数值
 current_sub_screen_name = None  # 当前子屏幕名称
 state_flag = 1  # 确认设备是否正常
-refresh_thread = None  # 用于定期刷新数据的线程
-refresh_flag = False  # 控制线程运行的标志
 sensor_labels = []  # 用于存储传感器显示标签的列表
-white_balance_calibration = False  # 白平衡校准
+active_screen = None  # 当前已加载的屏幕
+UI_FRAME_MS = 33  # 渲染帧间隔，约30帧/秒
+ui_lock = _thread.allocate_lock()
+ui_commands = {}       # 待执行的界面命令 目标: (函数, 参数)
+ui_command_order = []  # 命令提交顺序
 # 黑色字体
 style_black_text = lv.style_t()
 style_black_text.init()
@@ -45,29 +75,178 @@ style_black_text.set_text_color(lv.color_hex(0x000000))
 style_white_text = lv.style_t()
 style_white_text.init()
 style_white_text.set_text_color(lv.color_hex(0xFFFFFF))
+# 提示屏幕字体
+style_toast_text = lv.style_t()
+style_toast_text.init()
+style_toast_text.set_text_font(lv.font_montserrat_14)
+style_toast_text.set_text_color(lv.color_hex(0x000000))
+
+
+# 加载屏幕，已是当前屏幕时不重复加载（避免整屏重绘）
+def load_screen(screen):
+    global active_screen
+    if screen is active_screen:
+        return
+    active_screen = screen
+    lv.screen_load(screen)
+
+
+# 界面命令队列：LVGL只在渲染线程中操作，其他线程通过ui_post提交命令
+# 同一目标的命令在一帧内合并，只执行最后一次
+def ui_post(key, fn, *args):
+    with ui_lock:
+        if key in ui_commands:
+            ui_command_order.remove(key)  # 移到队尾，保证与其他命令的先后顺序
+        ui_command_order.append(key)
+        ui_commands[key] = (fn, args)
+
+
+def ui_set_text(label, text):
+    ui_post((label, "text"), label.set_text, text)
+
+
+def ui_load(screen):
+    ui_post("screen", load_screen, screen)
+
+
+# 执行本帧积累的界面命令
+def ui_flush():
+    global ui_commands, ui_command_order
+    with ui_lock:
+        if not ui_command_order:
+            return
+        commands, order = ui_commands, ui_command_order
+        ui_commands, ui_command_order = {}, []
+    for key in order:
+        fn, args = commands[key]
+        try:
+            fn(*args)
+        except Exception as error:
+            print("界面更新失败:", error)
 
 
 # 更新指针指向的按钮（新增处理空按钮列表的逻辑）
+# 只重设高亮发生变化的按钮，按钮列表切换时才全部重设
 def update_pointer(btn_list, index):
+    global pointer_list, pointer_index
     if not btn_list:  # 如果没有按钮，则直接返回
         return
-    for i, btn in enumerate(btn_list):
-        if i == index:
-            btn.set_style_bg_color(lv.color_hex(0xFF0000), 0)  # 红色背景
-        else:
-            btn.set_style_bg_color(lv.color_hex(0x87CEFA), 0)  # 淡蓝色背景
+    if btn_list is pointer_list:
+        if index == pointer_index:
+            return
+        if pointer_index < len(btn_list):
+            btn_list[pointer_index].set_style_bg_color(lv.color_hex(0x87CEFA), 0)  # 淡蓝色背景
+        btn_list[index].set_style_bg_color(lv.color_hex(0xFF0000), 0)  # 红色背景
+    else:
+        for i, btn in enumerate(btn_list):
+            if i == index:
+                btn.set_style_bg_color(lv.color_hex(0xFF0000), 0)  # 红色背景
+            else:
+                btn.set_style_bg_color(lv.color_hex(0x87CEFA), 0)  # 淡蓝色背景
+    pointer_list = btn_list
+    pointer_index = index
 
 
-# 每过一秒实时更新数据
-def update_sensor_data():
-    global sensor_labels, refresh_flag
-    while refresh_flag:
-        if current_sub_screen_name in ["Nine axis sensor", "Color sensor", "Temperature and humidity"]:
-            for lbl, item in sensor_labels:
-                value = getvalue(item["label"])
-                lbl.set_text(f"{item['label']}: {value}")
-                lv.task_handler()
-        time.sleep(1)
+# 只在数值变化时更新标签文字
+def update_label(lbl, name, value):
+    if lbl in label_values and label_values[lbl] == value:
+        return
+    label_values[lbl] = value
+    ui_set_text(lbl, f"{name}: {value}")
+
+
+# 传感器数据刷新：整个运行期间只有一个常驻的刷新线程（或任务），切换界面时只更换刷新目标
+class SENSOR_REFRESHER:
+    def __init__(self, period_ms=1000):
+        self.period_ms = period_ms
+        self.labels = []      # 当前刷新的 (标签, 数据项) 列表
+        self.target = None    # 当前刷新的子屏幕名称
+        self.active = False   # 是否正在刷新
+        self.running = False  # 工作线程是否应继续运行
+        self.live = 0         # 存活的工作线程数量，启动前在锁内加一，退出时在锁内减一
+        self.next_due = 0
+        self.lock = _thread.allocate_lock()
+
+    def start(self):
+        with self.lock:
+            self.running = True
+            if self.live:
+                return  # 原工作线程尚未退出，继续使用，不再启动新的
+            self.live += 1
+        try:
+            if USE_ASYNCIO:
+                asyncio.create_task(self.run_task())
+            else:
+                _thread.start_new_thread(self.run, ())
+        except Exception:
+            with self.lock:
+                self.live -= 1
+            raise
+
+    def retarget(self, name, labels):
+        # 切换到新的界面，下一轮立即刷新
+        self.target = name
+        self.labels = labels
+        self.next_due = time.ticks_ms()
+        self.active = True
+        self.start()
+
+    def pause(self):
+        self.active = False
+
+    def stop(self):
+        self.active = False
+        self.running = False
+
+    def join(self, timeout_ms=1000):
+        # 等待工作线程退出，超时返回False；asyncio模式下会阻塞调度器，应使用join_task
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while self.live and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+            time.sleep_ms(10)
+        return self.live == 0
+
+    async def join_task(self, timeout_ms=1000):
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while self.live and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+            await asyncio.sleep_ms(10)
+        return self.live == 0
+
+    def stats(self):
+        return {"live": self.live, "active": self.active, "target": self.target}
+
+    def step(self):
+        # 每100ms检查一次，停止和切换的响应时间不超过一个检查周期；出错只跳过本轮，工作线程继续运行
+        try:
+            self._refresh()
+        except Exception as error:
+            print("传感器刷新错误:", error)
+
+    def _refresh(self):
+        if not self.active or time.ticks_diff(time.ticks_ms(), self.next_due) < 0:
+            return
+        self.next_due = time.ticks_add(time.ticks_ms(), self.period_ms)
+        target = self.target
+        for lbl, item in self.labels:
+            if not self.active or self.target != target:
+                break
+            update_label(lbl, item["label"], getvalue(item["label"]))
+
+    def _keep_running(self):
+        # 检查退出条件和减少存活计数在同一个锁内完成，与start()互斥
+        with self.lock:
+            if not self.running:
+                self.live -= 1
+            return self.running
+
+    def run(self):
+        while self._keep_running():
+            self.step()
+            time.sleep_ms(100)
+
+    async def run_task(self):
+        while self._keep_running():
+            self.step()
+            await asyncio.sleep_ms(100)
 
 
 # 创建主屏幕
@@ -87,12 +266,34 @@ def create_main_screen():
     return btn_list
 
 
-# 创建子屏幕
-def create_sub_screen(name):
-    global screens, refresh_flag, refresh_thread, sensor_labels
+# 缓存淘汰：超出上限时删除最久未使用且不在显示中的屏幕
+def _cache_touch(order, key):
+    if key in order:
+        order.remove(key)
+    order.append(key)
+
+
+def _cache_evict(cache, order, limit, on_evict=None):
+    i = 0
+    while len(order) > limit and i < len(order):
+        key = order[i]
+        screen = cache[key][0]
+        if screen is active_screen or screen is current_sub_screen:
+            i += 1
+            continue
+        order.pop(i)
+        if on_evict:
+            on_evict(cache[key])
+        del cache[key]
+        screen.delete()
+
+
+# 创建子屏幕控件（只在缓存未命中时调用）
+def _build_sub_screen(name):
     sub_screen = lv.obj()
     btn_list = []
-    sensor_labels = []  # 清空传感器标签列表
+    labels = []
+    status_label = None
     # 显示子屏幕标题
     label_title = lv.label(sub_screen)
     label_title.set_text(f"{name} Settings")
@@ -103,26 +304,17 @@ def create_sub_screen(name):
     if name == "BLE":
         # 显示蓝牙连接状态
         status_label = lv.label(sub_screen)
-        status_label.set_text("Status: Connecting...")
         status_label.align(lv.ALIGN.TOP_LEFT, 10, 50)
         status_label.add_style(style_black_text, 0)
-        time.sleep(1)
-        BLE.start_connecting()
 
     # 判断是否需要使用按钮或文本文档
     elif name in ["Nine axis sensor", "Color sensor", "Temperature and humidity"]:
-        # 使用文本文档显示
+        # 使用文本文档显示，数值在进入界面时填入
         for i, item in enumerate(menu_items):
             lbl = lv.label(sub_screen)
-            value = getvalue(item["label"])  # 动态获取值
-            lbl.set_text(f"{item['label']}: {value}")
             lbl.align(lv.ALIGN.TOP_LEFT, 10, 40 + i * 30)
             lbl.add_style(style_black_text, 0)
-            sensor_labels.append((lbl, item))
-
-        # 启动数据刷新线程
-        refresh_flag = True
-        refresh_thread = _thread.start_new_thread(update_sensor_data, ())
+            labels.append((lbl, item))
 
     else:
         # 使用按钮显示
@@ -131,9 +323,6 @@ def create_sub_screen(name):
             btn.set_size(220, 30)
             btn.align(lv.ALIGN.TOP_LEFT, 10, 40 + i * 38)
             lbl = lv.label(btn)
-            # 如果为不可修改值，动态获取数值
-            if not item["modifiable"]:
-                item["value"] = getvalue(item["label"])
             lbl.set_text(f"{item['label']}: {item['value']}")
             lbl.add_style(style_black_text, 0)
             btn_list.append((btn, lbl, item))  # 按钮、标签、数据
@@ -148,32 +337,154 @@ def create_sub_screen(name):
             lbl_send.add_style(style_black_text, 0)
             btn_list.append((send_btn, lbl_send, None))
 
-    screens.append(sub_screen)
+    return [sub_screen, btn_list, labels, status_label]
+
+
+# 子屏幕被淘汰时清除对其控件的记录
+def _forget_sub_screen(entry):
+    global pointer_list
+    for lbl, _ in entry[2]:
+        label_values.pop(lbl, None)
+    for _, lbl, _ in entry[1]:
+        label_values.pop(lbl, None)
+    pointer_list = None
+
+
+# 创建子屏幕：优先复用缓存的屏幕，只更新标签数值
+def create_sub_screen(name):
+    global sensor_labels, current_sub_screen
+    entry = sub_screen_cache.get(name)
+    if entry is None:
+        entry = _build_sub_screen(name)
+        sub_screen_cache[name] = entry
+    sub_screen, btn_list, labels, status_label = entry
+    current_sub_screen = sub_screen
+    _cache_touch(sub_screen_order, name)
+    _cache_evict(sub_screen_cache, sub_screen_order, SUB_SCREEN_CACHE_SIZE, _forget_sub_screen)
+    sensor_labels = labels
+
+    if name == "BLE":
+        global ble_start_deadline
+        status_label.set_text("Status: Connecting...")
+        ble_start_deadline = time.ticks_add(time.ticks_ms(), BLE_START_DELAY_MS)
+
+    elif name in ["Nine axis sensor", "Color sensor", "Temperature and humidity"]:
+        # 进入颜色界面时若尚未校准则请求采样线程启动白平衡校准（失败后重新进入可重试）
+        if name == "Color sensor" and zc_drive.color_calibration_state() != zc_drive.CALIBRATION_SUCCESS:
+            zc_drive.color_calibration_request()
+        for lbl, item in labels:
+            update_label(lbl, item["label"], getvalue(item["label"]))  # 动态获取值
+
+        # 数据刷新切换到当前界面
+        sensor_refresher.retarget(name, labels)
+
+    else:
+        for btn, lbl, item in btn_list:
+            # 如果为不可修改值，动态获取数值
+            if item and not item["modifiable"]:
+                item["value"] = getvalue(item["label"])
+                update_label(lbl, item["label"], item["value"])
+
     return btn_list
 
 
-# 创建文本屏幕
-def create_screen(message, set_x=-1, set_y=-1, font_size=1, font_color=0x000000):
-    screen = lv.obj()
-    label = lv.label(screen)
-    label.set_text(message)
-    if set_x == -1 or set_y == -1:
+# 提示屏幕（"Send Success!"、蓝牙状态等），按类型缓存复用
+def toast_screen(key, message=None):
+    entry = toast_cache.get(key)
+    if entry is None:
+        screen = lv.obj()
+        label = lv.label(screen)
         label.align(lv.ALIGN.CENTER, 0, 0)
-    else:
-        label.set_pos(set_x, set_y)
-    style = lv.style_t()
-    style.init()
-    font = lv.font_montserrat_16  # 默认字体
+        label.add_style(style_toast_text, 0)
+        entry = [screen, label, None]  # 屏幕、标签、当前文字
+        toast_cache[key] = entry
+    text = key if message is None else message
+    if entry[2] != text:
+        entry[1].set_text(text)
+        entry[2] = text
+    _cache_touch(toast_order, key)
+    _cache_evict(toast_cache, toast_order, TOAST_CACHE_SIZE)
+    return entry[0]
+
+
+# 显示提示屏幕，到时后由渲染循环切回return_screen，期间不处理按键
+def show_toast(key, return_screen, duration_ms=1000):
+    global toast_return, toast_deadline
+    load_screen(toast_screen(key))
+    lv.task_handler()
+    toast_return = return_screen
+    toast_deadline = time.ticks_add(time.ticks_ms(), duration_ms)
+
+
+def toast_pending():
+    global toast_return
+    if toast_return is None:
+        return False
+    if time.ticks_diff(toast_deadline, time.ticks_ms()) > 0:
+        return True
+    load_screen(toast_return)
+    toast_return = None
+    return False
+
+
+# 文字屏幕字体
+def _text_font(font_size):
     if font_size == 1:
-        font = lv.font_montserrat_14
-    elif font_size == 2:
-        font = lv.font_montserrat_16
+        return lv.font_montserrat_14
     elif font_size == 3:
-        font = lv.font_montserrat_24
-    style.set_text_font(font)
-    style.set_text_color(lv.color_hex(font_color))
-    label.add_style(style, 0)
-    return screen
+        return lv.font_montserrat_24
+    return lv.font_montserrat_16  # 默认字体
+
+
+# 按字号和颜色获取文字样式，最近使用的样式保留在缓存中
+def _text_style(font_size, font_color):
+    global text_style_hits, text_style_misses
+    key = (font_size, font_color)
+    style = text_styles.get(key)
+    if style is None:
+        text_style_misses += 1
+        style = lv.style_t()
+        style.init()
+        style.set_text_font(_text_font(font_size))
+        style.set_text_color(lv.color_hex(font_color))
+        text_styles[key] = style
+    else:
+        text_style_hits += 1
+    _cache_touch(text_style_order, key)
+    # 淘汰最久未使用、且未挂在标签上的样式
+    i = 0
+    while len(text_style_order) > TEXT_STYLE_CACHE_SIZE and i < len(text_style_order):
+        old_key = text_style_order[i]
+        if text_styles[old_key] is text_style_current or old_key == key:
+            i += 1
+            continue
+        text_style_order.pop(i)
+        del text_styles[old_key]
+    return style
+
+
+def text_style_stats():
+    return {"hits": text_style_hits, "misses": text_style_misses, "size": len(text_styles)}
+
+
+# 显示文字：复用同一个文字屏幕和标签，只更新文字、位置和样式
+def show_text(message, set_x=-1, set_y=-1, font_size=1, font_color=0x000000):
+    global text_screen, text_label, text_style_current
+    if text_screen is None:
+        text_screen = lv.obj()
+        text_label = lv.label(text_screen)
+    style = _text_style(font_size, font_color)
+    if style is not text_style_current:
+        if text_style_current is not None:
+            text_label.remove_style(text_style_current, 0)
+        text_label.add_style(style, 0)
+        text_style_current = style
+    text_label.set_text(message)
+    if set_x == -1 or set_y == -1:
+        text_label.align(lv.ALIGN.CENTER, 0, 0)
+    else:
+        text_label.set_pos(set_x, set_y)
+    load_screen(text_screen)
 
 
 # 模拟发送数值的函数
@@ -184,8 +495,7 @@ def send_value(sub_menu_items, current_screen_name):
         led_green = sub_menu_items[2]['value']
         led_blue = sub_menu_items[3]['value']
         led_brightness = sub_menu_items[4]['value']
-        rgb[led_port] = (led_red, led_green, led_blue)
-        rgb.write()
+        rgb.set(led_port, (led_red, led_green, led_blue), led_brightness)
     elif current_screen_name == 'Motor':
         motor_port = sub_menu_items[0]['value']
         motor_direction = sub_menu_items[1]['value']
@@ -201,19 +511,17 @@ def send_value(sub_menu_items, current_screen_name):
         buzzer_song1 = sub_menu_items[2]['value']
         buzzer_time1 = sub_menu_items[3]['value']
         buzzer_duty1 = sub_menu_items[4]['value']
+        # 交给蜂鸣器线程播放，不阻塞渲染线程
         if buzzer_song1 == 1:
             melodies = jingle
-            zc_drive.buzzer_play(buzzer_port1, melodies, buzzer_time1, buzzer_duty1)
+            zc_drive.buzzer_player_play(buzzer_port1, melodies, buzzer_time1, buzzer_duty1)
         else:
-            zc_drive.buzzer_start(buzzer_port1, buzzer_freq1, 512)
-            time.sleep(1)
-            zc_drive.buzzer_stop(buzzer_port1)
-            time.sleep(1)
+            zc_drive.buzzer_player_play(buzzer_port1, (buzzer_freq1,), 1000, 512)
 
 
 # 获取非可修改数据的值
 def getvalue(label):
-    global state_flag, refresh_flag, white_balance_calibration
+    global state_flag
     # 定义数据处理映射表
     sensor_data_mapping = {
         "Accelerometer": lambda data: (data[1], data[2], data[3]),
@@ -228,43 +536,55 @@ def getvalue(label):
 
     # 九轴数据处理
     if label in sensor_data_mapping:
-        ret = zc_drive.G_sensor_get_data()
+        ret = zc_drive.G_sensor_snapshot()
         state_flag = ret[0]
         return sensor_data_mapping[label](ret)
     # 颜色数据处理
     if label in color_sensor_mapping:
-        if not white_balance_calibration:
-            lv.screen_load(create_screen("In white balance calibration..."))
-            lv.task_handler()
-            white_balance_calibration = zc_drive.color_sensor_init()
-            if white_balance_calibration:
-                lv.screen_load(create_screen("calibration success !"))
-                lv.task_handler()
-                time.sleep(1)
-            else:
-                lv.screen_load(create_screen("calibration Failed !"))
-                lv.task_handler()
-                time.sleep(1)
-        ret = zc_drive.color_sensor_get_rgb()
+        ret = zc_drive.color_sensor_snapshot()
         state_flag = ret[0]
+        # 白平衡校准在后台进行，期间显示进度而不是阻塞界面
+        if ret[0] == zc_drive.COLOR_NOT_CALIBRATED:
+            calibration_state = zc_drive.color_calibration_state()
+            if calibration_state == zc_drive.CALIBRATION_RUNNING:
+                return f"calibrating {zc_drive.color_calibration_progress()}%"
+            if calibration_state == zc_drive.CALIBRATION_FAILED:
+                return "calibration failed"
+            return "not calibrated"
         return ret[color_sensor_mapping[label]]
     # 温湿度数据处理
     if label == "Temperature" or label == "Humidity":
-        ret = zc_drive.get_temperature_humidity()
+        ret = zc_drive.temperature_humidity_snapshot()
         state_flag = ret[0]
         return ret[2] if label == "Temperature" else ret[1]
 
     if state_flag == 0:
-        refresh_flag = False
+        sensor_refresher.pause()
 
     return 0
 
 
-# 处理按钮输入
+# 处理按键事件队列：每个按下事件处理一次，按键不会因界面繁忙而丢失
 def handle_buttons():
-    global current_menu, current_index, editing_mode, main_menu_buttons, sub_menu_buttons, current_sub_screen_name, refresh_flag
+    while True:
+        event = keypad.get_event()
+        if not event:
+            break
+        event_type = event >> 4
+        key = event & 0x0F
+        if event_type == KEY_PRESS:
+            handle_key(key)
+        # 编辑模式下长按上下键连续调整，按住越久步长越大
+        elif event_type == KEY_REPEAT and editing_mode and key in (BUTTON_UP, BUTTON_DOWN):
+            label = sub_menu_buttons[current_index][2]["label"]
+            handle_key(key, repeat_step(label, keypad.held_ms()), is_repeat=True)
+
+
+# 处理一次按键
+def handle_key(button_get, step=1, is_repeat=False):
+    global current_menu, current_index, editing_mode, main_menu_buttons, sub_menu_buttons, sub_menu_pointer_buttons, \
+        current_sub_screen_name
 
-    button_get = get_button_ADC()
     # 判断当前界面是否为文本文档界面
     is_text_only = current_menu == "sub" and current_sub_screen_name in [
         "Nine axis sensor", "Color sensor", "Temperature and humidity", "BLE"
@@ -285,22 +605,17 @@ def handle_buttons():
             current_menu = "sub"
             current_sub_screen_name = main_menu_items[current_index]
             sub_menu_buttons = create_sub_screen(current_sub_screen_name)
+            sub_menu_pointer_buttons = [btn for btn, _, _ in sub_menu_buttons]
             # 如果获取数值失败
             if state_flag == 0:
-                refresh_flag = False
-                time.sleep(0.1)
+                sensor_refresher.pause()
                 current_menu = "main"
-                lv.screen_load(create_screen("Connecting failed!"))
-                lv.task_handler()
-                time.sleep(1)
-                lv.screen_load(screens[0])
-                lv.task_handler()
+                show_toast("Connecting failed!", screens[0])
                 current_index = 0
                 state_flag = 1
             # 加载子屏幕
             else:
-                lv.screen_load(screens[-1])
-                lv.task_handler()
+                load_screen(current_sub_screen)
                 current_index = 0
         # 进入编辑模式
         elif current_menu == "sub" and not is_text_only and sub_menu_buttons[current_index][2] and \
@@ -309,11 +624,7 @@ def handle_buttons():
                 editing_mode = True
         # 发送数据
         elif current_menu == "sub" and not is_text_only and sub_menu_buttons[current_index][2] is None:
-            lv.screen_load(create_screen("Send Success!"))
-            lv.task_handler()
-            time.sleep(1)
-            lv.screen_load(screens[-1])
-            lv.task_handler()
+            show_toast("Send Success!", current_sub_screen)
             current_index = 0
             send_value(sub_menu_data[current_sub_screen_name], current_sub_screen_name)
 
@@ -329,12 +640,12 @@ def handle_buttons():
             # 返回主屏幕
             else:
                 if current_sub_screen_name == "BLE":
+                    global ble_start_deadline
+                    ble_start_deadline = None
                     BLE.stop_connecting()
-                refresh_flag = False
-                time.sleep(0.1)
+                sensor_refresher.pause()
                 current_menu = "main"
-                lv.screen_load(screens[0])
-                lv.task_handler()
+                load_screen(screens[0])
 
     # 编辑模式下修改值
     if editing_mode and current_menu == "sub" and not is_text_only:
@@ -342,26 +653,31 @@ def handle_buttons():
         value = current_item["value"]
         label = current_item["label"]
         min_val, max_val = value_ranges.get(label.lower(), value_ranges["other"])
-        # 上下键调整值并处理循环
+        # 上下键调整值：长按连续调整停在边界，松开后再按一次才循环
         if button_get == BUTTON_UP:  # 上键增加值
-            value = min_val if value >= max_val else value + 1
+            value = min_val if value >= max_val and not is_repeat else min(value + step, max_val)
         elif button_get == BUTTON_DOWN:  # 下键减少值
-            value = max_val if value <= min_val else value - 1
-        # 更新值
-        current_item["value"] = value
-        sub_menu_buttons[current_index][1].set_text(f"{label}: {value}")
-        sub_menu_buttons[current_index][1].add_style(style_white_text, 0)
+            value = max_val if value <= min_val and not is_repeat else max(value - step, min_val)
+        # 只在数值变化或刚进入编辑模式时更新标签，同一帧内的多次修改合并为一次重绘
+        if button_get == BUTTON_RIGHT:
+            sub_menu_buttons[current_index][1].add_style(style_white_text, 0)
+        if value != current_item["value"] or button_get == BUTTON_RIGHT:
+            current_item["value"] = value
+            ui_set_text(sub_menu_buttons[current_index][1], f"{label}: {value}")
 
     # 更新指针
     if current_menu == "main":
         update_pointer(main_menu_buttons, current_index)
     elif current_menu == "sub" and not is_text_only:
-        update_pointer([btn for btn, _, _ in sub_menu_buttons], current_index)
+        update_pointer(sub_menu_pointer_buttons, current_index)
 
 
+sensor_refresher = SENSOR_REFRESHER()
+
 # 初始化主屏幕并加载
 main_menu_buttons = create_main_screen()
-lv.screen_load(screens[0])
+update_pointer(main_menu_buttons, current_index)
+load_screen(screens[0])
 lv.task_handler()
 
 ################################蓝牙###################################
@@ -369,6 +685,8 @@ lv.task_handler()
 # 创建 5x5 按钮点阵
 rows, cols = 5, 5
 btn_matrix = []
+matrix_screen = None  # 点阵屏幕，首次使用时创建并一直复用
+matrix_colors = [[-1] * cols for _ in range(rows)]  # 各格子当前显示的颜色，-1表示未设置
 btn_size, spacing = 20, 10
 x_start, y_start = 10, 10
 bright_color_0 = 0x000000
@@ -380,20 +698,360 @@ binary_data = [
     "00000",
     "00000",
 ]
-message_lock = _thread.allocate_lock()
-message_queue = []  # 消息队列
+BLE_MTU = 247            # 期望协商的ATT MTU，单包有效数据最多 BLE_MTU - 3 字节
+BLE_DEFAULT_MTU = 23     # 协商前的默认MTU
+MESSAGE_QUEUE_SIZE = 16  # 消息队列容量
+MESSAGE_SLOT_SIZE = BLE_MTU - 3  # 单条消息最大长度，与接收缓冲区一致
+QUEUE_DROP_OLDEST = 0    # 队列满时丢弃最旧的消息
+QUEUE_LATEST_WINS = 1    # 同一指令只保留最新一条，未处理的旧消息被覆盖
+# 各指令的溢出策略，未列出的指令使用QUEUE_DROP_OLDEST
+message_policy = {
+    0xF3: QUEUE_LATEST_WINS,  # 屏幕文字
+    0xE2: QUEUE_LATEST_WINS,  # 长文字
+    0xE5: QUEUE_LATEST_WINS,  # 旋律
+    0xF5: QUEUE_LATEST_WINS,  # 点阵图案
+    0xF6: QUEUE_LATEST_WINS,  # 点阵颜色
+    0xF9: QUEUE_LATEST_WINS,  # 双电机速度
+    0xFA: QUEUE_LATEST_WINS,  # 蜂鸣器节拍
+}
+
+
+class MESSAGE_QUEUE:
+    """定长环形消息队列，槽位预先分配，入队时唤醒处理线程"""
+    def __init__(self, capacity=MESSAGE_QUEUE_SIZE, slot_size=MESSAGE_SLOT_SIZE, policy=None):
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self.policy = message_policy if policy is None else policy
+        self.slots = [bytearray(slot_size) for _ in range(capacity)]
+        self.views = [memoryview(slot) for slot in self.slots]
+        self.lengths = [0] * capacity
+        self.head = 0   # 下一条待处理消息的位置
+        self.count = 0
+        self.lock = _thread.allocate_lock()
+        # 作为信号量使用：入队时释放，处理线程在队列为空时阻塞获取
+        self.wakeup = _thread.allocate_lock()
+        self.wakeup.acquire()
+        self.flag = None  # asyncio模式下的asyncio.ThreadSafeFlag
+        self.pending = bytearray(slot_size)  # asyncio模式下中断无法获取锁时的备用槽位
+        self.pending_view = memoryview(self.pending)
+        self.pending_length = 0
+        # 统计
+        self.dropped = 0
+        self.replaced = 0
+        self.max_depth = 0
+
+    def put(self, data):
+        length = len(data)
+        if length == 0:
+            return False
+        if length > self.slot_size:
+            print("消息过长，已丢弃:", length)
+            self.dropped += 1
+            return False
+        if self.flag is None:
+            with self.lock:
+                self._put_locked(data, length)
+        elif self.lock.acquire(0):
+            try:
+                self._put_locked(data, length)
+            finally:
+                self.lock.release()
+        else:
+            # asyncio模式下蓝牙中断打断了正在取消息的任务，先放入备用槽位，避免死锁
+            if self.pending_length:
+                self.dropped += 1
+                return False
+            self.pending_view[:length] = data
+            self.pending_length = length
+        self.notify()
+        return True
+
+    def _put_locked(self, data, length):
+        slot = -1
+        if self.policy.get(data[0], QUEUE_DROP_OLDEST) == QUEUE_LATEST_WINS:
+            # 覆盖队列中尚未处理的同一指令
+            for i in range(self.count):
+                index = (self.head + i) % self.capacity
+                if self.lengths[index] and self.slots[index][0] == data[0]:
+                    slot = index
+                    self.replaced += 1
+                    break
+        if slot < 0:
+            if self.count == self.capacity:
+                # 队列已满，丢弃最旧的消息
+                self.head = (self.head + 1) % self.capacity
+                self.count -= 1
+                self.dropped += 1
+            slot = (self.head + self.count) % self.capacity
+            self.count += 1
+            self.max_depth = max(self.max_depth, self.count)
+        self.views[slot][:length] = data
+        self.lengths[slot] = length
+
+    def get_into(self, buf):
+        """取出最旧的一条消息拷贝到buf，返回长度，队列为空时返回0"""
+        if self.pending_length:
+            self.put(self.pending_view[:self.pending_length])
+            self.pending_length = 0
+        with self.lock:
+            if self.count == 0:
+                return 0
+            slot = self.head
+            length = self.lengths[slot]
+            buf[:length] = self.views[slot][:length]
+            self.lengths[slot] = 0
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+            return length
+
+    def notify(self):
+        if self.flag is not None:
+            self.flag.set()
+            return
+        try:
+            self.wakeup.release()
+        except RuntimeError:
+            pass  # 已有未处理的唤醒信号
+
+    def wait(self):
+        self.wakeup.acquire()
+
+    def depth(self):
+        return self.count
+
+    def stats(self):
+        return {"depth": self.count, "max_depth": self.max_depth,
+                "dropped": self.dropped, "replaced": self.replaced}
+
+
+message_queue = MESSAGE_QUEUE()  # 消息队列
+
+
+# 分片传输，双向通用: E0 传输编号 分片序号 分片总数 数据...
+# 超过单包容量的消息拆成多个分片按序发送，接收方拼接后作为一条完整消息处理
+FRAGMENT_OPCODE = 0xE0
+FRAGMENT_HEADER = 4
+FRAGMENT_BUFFER_SIZE = 1024  # 重组后的消息最大长度
+
+
+class FRAGMENT_ASSEMBLER:
+    """分片重组，BLE链路保证分片按序到达，出现缺失或乱序时丢弃整个传输"""
+    def __init__(self, size=FRAGMENT_BUFFER_SIZE):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.transfer = -1  # 正在重组的传输编号，-1表示空闲
+        self.expected = 0   # 下一个期望的分片序号
+        self.length = 0
+        # 统计
+        self.completed = 0
+        self.dropped = 0
+
+    def reset(self):
+        if self.transfer >= 0:
+            self.dropped += 1
+        self.transfer = -1
+        self.expected = 0
+        self.length = 0
+
+    def feed(self, fragment):
+        """加入一个分片，重组完成时返回完整消息的视图，否则返回None"""
+        if len(fragment) <= FRAGMENT_HEADER:
+            print("分片长度错误")
+            return None
+        transfer, index, count = fragment[1], fragment[2], fragment[3]
+        if index == 0:
+            self.reset()
+            self.transfer = transfer
+        elif transfer != self.transfer or index != self.expected:
+            print(f"传输{transfer}分片{index}缺失或乱序，已丢弃")
+            self.reset()
+            return None
+        size = len(fragment) - FRAGMENT_HEADER
+        if self.length + size > len(self.buf):
+            print(f"传输{transfer}超过{len(self.buf)}字节，已丢弃")
+            self.reset()
+            return None
+        self.view[self.length:self.length + size] = fragment[FRAGMENT_HEADER:]
+        self.length += size
+        self.expected = index + 1
+        if self.expected < count:
+            return None
+        length = self.length
+        self.transfer = -1
+        self.expected = 0
+        self.length = 0
+        self.completed += 1
+        return self.view[:length]
+
+    def stats(self):
+        return {"completed": self.completed, "dropped": self.dropped}
+
+
+fragment_assembler = FRAGMENT_ASSEMBLER()
 # 蜂鸣器演奏
-buzzer_flag = False
+BUZZER_BEAT_GAP_MS = 500  # 节拍之间的间隔
 buzzer_port = 4
 buzzer_frequency = 2000
 buzzer_wait = 1
 buzzer_duty = 0
 
 
+# 通知发送队列，按优先级从高到低发送
+TX_CONTROL = 0    # 控制应答
+TX_STREAM = 1     # 数据流
+TX_HEARTBEAT = 2  # 心跳包，只保留最新一个，未发出的旧心跳被覆盖
+TX_QUEUE_SIZE = (8, 16, 1)    # 各优先级的槽位数
+TX_RETRY_MS = (5, 80)         # 协议栈缓冲区满时的重试间隔，每次失败翻倍
+TX_MAX_RETRIES = 8            # 同一条通知连续失败次数上限，超过后丢弃
+
+
+class TX_QUEUE:
+    """按优先级排队的通知发送队列，槽位预先分配，入队时唤醒发送线程"""
+    def __init__(self, slot_size=BLE_MTU - 3):
+        self.slot_size = slot_size
+        self.slots = [[bytearray(slot_size) for _ in range(size)] for size in TX_QUEUE_SIZE]
+        self.views = [[memoryview(slot) for slot in slots] for slots in self.slots]
+        self.lengths = [[0] * size for size in TX_QUEUE_SIZE]
+        self.times = [[0] * size for size in TX_QUEUE_SIZE]  # 入队时间，用于统计排队延迟
+        self.heads = [0] * len(TX_QUEUE_SIZE)
+        self.counts = [0] * len(TX_QUEUE_SIZE)
+        self.lock = _thread.allocate_lock()
+        # 作为信号量使用：入队时释放，发送线程在队列为空时阻塞获取
+        self.wakeup = _thread.allocate_lock()
+        self.wakeup.acquire()
+        self.flag = None  # asyncio模式下的asyncio.ThreadSafeFlag
+        self.retry_ms = 0
+        self.failures = 0
+        # 统计
+        self.sent = [0] * len(TX_QUEUE_SIZE)
+        self.dropped = [0] * len(TX_QUEUE_SIZE)
+        self.replaced = 0
+        self.retries = 0
+        self.latency_total = [0] * len(TX_QUEUE_SIZE)
+        self.latency_max = [0] * len(TX_QUEUE_SIZE)
+
+    def put(self, data, priority=TX_CONTROL):
+        length = len(data)
+        if length == 0 or length > self.slot_size:
+            print("通知长度错误，已丢弃:", length)
+            self.dropped[priority] += 1
+            return False
+        capacity = TX_QUEUE_SIZE[priority]
+        with self.lock:
+            if priority == TX_HEARTBEAT and self.counts[priority]:
+                # 覆盖尚未发出的旧心跳
+                slot = self.heads[priority]
+                self.replaced += 1
+            else:
+                if self.counts[priority] == capacity:
+                    # 队列已满，丢弃最旧的通知
+                    self.heads[priority] = (self.heads[priority] + 1) % capacity
+                    self.counts[priority] -= 1
+                    self.dropped[priority] += 1
+                slot = (self.heads[priority] + self.counts[priority]) % capacity
+                self.counts[priority] += 1
+            self.views[priority][slot][:length] = data
+            self.lengths[priority][slot] = length
+            self.times[priority][slot] = time.ticks_ms()
+        self.notify()
+        return True
+
+    def full(self, priority):
+        return self.counts[priority] == TX_QUEUE_SIZE[priority]
+
+    def clear(self):
+        with self.lock:
+            for priority in range(len(TX_QUEUE_SIZE)):
+                self.dropped[priority] += self.counts[priority]
+                self.counts[priority] = 0
+            self.retry_ms = 0
+            self.failures = 0
+
+    def flush(self, notify):
+        """按优先级依次发送，返回重试前需等待的毫秒数，队列已空时返回0"""
+        while True:
+            with self.lock:
+                priority = 0
+                while priority < len(TX_QUEUE_SIZE) and self.counts[priority] == 0:
+                    priority += 1
+                if priority == len(TX_QUEUE_SIZE):
+                    self.retry_ms = 0
+                    return 0
+                slot = self.heads[priority]
+                try:
+                    if not notify(self.views[priority][slot][:self.lengths[priority][slot]]):
+                        return 0  # 连接已断开，保留队列，由调用方清空
+                except OSError:
+                    # 协议栈发送缓冲区已满，退避后重试
+                    self.retries += 1
+                    self.failures += 1
+                    if self.failures < TX_MAX_RETRIES:
+                        self.retry_ms = min(TX_RETRY_MS[1], self.retry_ms * 2) if self.retry_ms else TX_RETRY_MS[0]
+                        return self.retry_ms
+                    print("通知发送失败，已丢弃")
+                    self.dropped[priority] += 1
+                else:
+                    self.sent[priority] += 1
+                    latency = time.ticks_diff(time.ticks_ms(), self.times[priority][slot])
+                    self.latency_total[priority] += latency
+                    self.latency_max[priority] = max(self.latency_max[priority], latency)
+                self.failures = 0
+                self.retry_ms = 0
+                self.heads[priority] = (slot + 1) % TX_QUEUE_SIZE[priority]
+                self.counts[priority] -= 1
+
+    def notify(self):
+        if self.flag is not None:
+            self.flag.set()
+            return
+        try:
+            self.wakeup.release()
+        except RuntimeError:
+            pass  # 已有未处理的唤醒信号
+
+    def wait(self):
+        self.wakeup.acquire()
+
+    def stats(self):
+        return {"depth": list(self.counts), "sent": list(self.sent), "dropped": list(self.dropped),
+                "replaced": self.replaced, "retries": self.retries,
+                "latency_avg_ms": [total // sent if sent else 0 for total, sent in zip(self.latency_total, self.sent)],
+                "latency_max_ms": list(self.latency_max)}
+
+
+# 连接参数配置: (最小间隔, 最大间隔, 从机延迟, 监督超时)，间隔单位1.25ms，超时单位10ms
+BLE_PROFILE_LOW_LATENCY = 0  # 实时遥控：7.5~15ms间隔，不跳过连接事件
+BLE_PROFILE_LOW_POWER = 1    # 空闲省电：100~200ms间隔，允许跳过4个连接事件
+BLE_PROFILES = {
+    BLE_PROFILE_LOW_LATENCY: (6, 12, 0, 200),
+    BLE_PROFILE_LOW_POWER: (80, 160, 4, 600),
+}
+BLE_PARAMS_REQUEST = 0xE3  # 连接参数请求通知: E3 最小间隔 最大间隔 从机延迟 监督超时(均为2字节小端)
+
+
 class ESP32_BLE:
     def __init__(self, name):
         self.name = name
         self.is_connected = False
+        self.status_toast = None  # 待显示的连接状态提示，由渲染循环取走显示
+        self.conn_handle = None
+        self.mtu = BLE_DEFAULT_MTU  # 当前ATT MTU，单个通知最多可携带 mtu - 3 字节
+        self.profile = BLE_PROFILE_LOW_LATENCY
+        # 中心设备实际采用的连接参数，由连接参数更新事件记录
+        self.conn_interval = 0
+        self.conn_latency = 0
+        self.supervision_timeout = 0
+        self.params_packet = bytearray(9)
+        self.params_pending = False  # 连接后待发送的连接参数请求，由发送线程发出
+        self.tx_queue = TX_QUEUE()
+        self.fragment_id = 0
+        self.fragment_packet = bytearray(BLE_MTU - 3)
+        self.fragment_view = memoryview(self.fragment_packet)
+        # 正在分片发送的数据，由发送线程按队列空位逐个放入分片
+        self.large_data = None
+        self.large_chunk = 0
+        self.large_index = 0
+        self.large_count = 0
         self.ble = bluetooth.BLE()
         self.ble.active(False)
         self.ble.config(gap_name=name)
@@ -405,37 +1063,146 @@ class ESP32_BLE:
         services = (
             (service_uuid, ((sender_uuid, bluetooth.FLAG_NOTIFY), (reader_uuid, bluetooth.FLAG_WRITE_NO_RESPONSE),)),)
         ((self.tx, self.rx),) = self.ble.gatts_register_services(services)
+        # 默认接收缓冲区只有20字节，放大到协商后的最大写入长度
+        self.ble.gatts_set_buffer(self.rx, BLE_MTU - 3)
 
     def advertiser(self):
         name = bytes(self.name, 'UTF-8')
         adv_data = bytearray([2, 1, 2]) + bytearray((len(name) + 1, 0x09)) + name
+        # 广播当前配置的期望连接间隔范围(AD类型0x12)，供中心设备建立连接时参考
+        interval_min, interval_max, _, _ = BLE_PROFILES[self.profile]
+        adv_data += struct.pack("<BBHH", 5, 0x12, interval_min, interval_max)
         self.ble.gap_advertise(100, adv_data)
 
+    def set_profile(self, profile):
+        """切换连接参数配置，已连接时通知手机端按新参数发起连接参数更新"""
+        if profile not in BLE_PROFILES:
+            print("未知连接配置:", profile)
+            return
+        self.profile = profile
+        if self.is_connected:
+            self.request_params()
+        elif self.ble.active():
+            self.advertiser()
+
+    def request_params(self):
+        # 外设无法直接修改连接参数，由手机端收到请求后发起更新
+        self.params_pending = False
+        struct.pack_into("<BHHHH", self.params_packet, 0, BLE_PARAMS_REQUEST, *BLE_PROFILES[self.profile])
+        self.send(self.params_packet)
+
     def ble_irq(self, event, data):
-        global message_queue
         if event == 1:  # 连接事件
             print("蓝牙已连接")
+            self.conn_handle = data[0]
             self.is_connected = True
-            lv.screen_load(create_screen("Status: Connected !"))
-            lv.task_handler()
+            self.status_toast = "Status: Connected !"
+            try:
+                self.ble.gattc_exchange_mtu(self.conn_handle)  # 主动发起MTU协商
+            except Exception as error:
+                print("MTU协商失败:", error)
+            # 中断中不操作发送队列的锁，交给发送线程发出
+            self.params_pending = True
+            self.tx_queue.notify()
         elif event == 2:  # 断开连接
             print("蓝牙已断开")
+            self.conn_handle = None
             self.is_connected = False
-            lv.screen_load(create_screen("Status: Disconnected !"))
-            lv.task_handler()
+            self.mtu = BLE_DEFAULT_MTU
+            self.conn_interval = 0
+            self.status_toast = "Status: Disconnected !"
+            # 订阅随连接失效，恢复默认采样周期，重连后需重新订阅
+            imu_stream.unsubscribe()
+            self.tx_queue.notify()  # 唤醒发送线程清空队列
         elif event == 3:  # 数据接收
             BLE_MSG = self.ble.gatts_read(self.rx)
             print("收到消息:", BLE_MSG)
-            with message_lock:
-                message_queue.append(BLE_MSG)
+            message_queue.put(BLE_MSG)
+        elif event == 21:  # MTU协商完成
+            self.mtu = min(data[1], BLE_MTU)
+            print("MTU:", self.mtu)
+        elif event == 27:  # 连接参数更新
+            _, self.conn_interval, self.conn_latency, self.supervision_timeout, status = data
+            print(f"连接间隔: {self.conn_interval * 1.25}ms, 从机延迟: {self.conn_latency}, 状态: {status}")
         else:
             print("未知事件:", event)
 
-    def send(self, data):
-        self.ble.gatts_notify(1, self.tx, data)
+    def send(self, data, priority=TX_CONTROL):
+        """数据拷贝进发送队列后立即返回，由发送线程按优先级发出"""
+        return self.tx_queue.put(data, priority)
+
+    def notify(self, data):
+        """发送一个通知，连接已断开时返回False"""
+        # 断开中断可能随时清除conn_handle，只读取一次
+        conn_handle = self.conn_handle
+        if conn_handle is None:
+            return False
+        self.ble.gatts_notify(conn_handle, self.tx, data)
+        return True
+
+    def flush(self):
+        """发送排队的通知，返回重试前需等待的毫秒数，队列已空时返回0"""
+        if not self.is_connected:
+            self.tx_queue.clear()
+            self.large_data = None
+            return 0
+        if self.params_pending:
+            self.request_params()
+        while True:
+            self._feed_large()
+            wait = self.tx_queue.flush(self.notify)
+            if wait or self.large_data is None:
+                return wait
+
+    def send_large(self, data):
+        """发送任意长度的数据，超过单个通知容量时拆分为E0分片，由发送线程陆续发出，不阻塞调用者"""
+        payload = self.payload_size()
+        length = len(data)
+        if length <= payload:
+            return self.send(data)
+        if self.large_data is not None:
+            print("上一次分片发送尚未完成")
+            return False
+        chunk = payload - FRAGMENT_HEADER
+        count = (length + chunk - 1) // chunk
+        if count > 255:
+            raise ValueError("数据过长")
+        self.fragment_id = (self.fragment_id + 1) & 0xFF
+        self.large_chunk = chunk
+        self.large_index = 0
+        self.large_count = count
+        self.large_data = bytes(data)  # 最后设置，发送线程据此开始分片
+        self.tx_queue.notify()
+        return True
+
+    def _feed_large(self):
+        # 发送队列有空位时放入下一个分片，分片不会因队列满而被丢弃
+        data = self.large_data
+        packet = self.fragment_packet
+        while data is not None and not self.tx_queue.full(TX_STREAM):
+            start = self.large_index * self.large_chunk
+            size = min(self.large_chunk, len(data) - start)
+            packet[0] = FRAGMENT_OPCODE
+            packet[1] = self.fragment_id
+            packet[2] = self.large_index
+            packet[3] = self.large_count
+            self.fragment_view[FRAGMENT_HEADER:FRAGMENT_HEADER + size] = data[start:start + size]
+            self.send(self.fragment_view[:FRAGMENT_HEADER + size], TX_STREAM)
+            self.large_index += 1
+            if self.large_index == self.large_count:
+                self.large_data = data = None
+
+    def payload_size(self):
+        return self.mtu - 3
+
+    def stats(self):
+        return {"mtu": self.mtu, "profile": self.profile,
+                "interval_ms": self.conn_interval * 1.25, "latency": self.conn_latency,
+                "timeout_ms": self.supervision_timeout * 10, "tx": self.tx_queue.stats()}
 
     def start_connecting(self):
         self.ble.active(True)
+        self.ble.config(mtu=BLE_MTU)
         self.register()
         self.advertiser()
         self.ble.irq(self.ble_irq)
@@ -446,322 +1213,771 @@ class ESP32_BLE:
 
 
 # 心跳包
-def keepalive():
-    global white_balance_calibration
-    if not white_balance_calibration:
-        try:
-            white_balance_calibration = zc_drive.color_sensor_init()
-            color_R_G_B = 0x09
-        except Exception as error:
-            print('White balance calibration failed:', error)
-            color_R_G_B = 0x00
-    ret1 = zc_drive.get_temperature_humidity()  # 温湿度传感器
-    ret2 = zc_drive.G_sensor_get_data()         # 九轴传感器
-    ret3 = zc_drive.color_sensor_get_rgb()      # 颜色传感器
-    # 加速度
-    if ret2[1] > 2048:
-        acc_x = 255
-    elif ret2[1] < -2048:
-        acc_x = 0
-    else:
-        acc_x = (ret2[1] + 2048)/16
-
-    if ret2[2] > 2048:
-        acc_y = 255
-    elif ret2[2] < -2048:
-        acc_y = 0
-    else:
-        acc_y = (ret2[2] + 2048)/16
-
-    if ret2[3] > 2048:
-        acc_z = 255
-    elif ret2[3] < -2048:
-        acc_z = 0
-    else:
-        acc_z = (ret2[3] + 2048)/16
-
-    accelerometer_X = (abs(acc_x-128), int(acc_x), 1)
-    accelerometer_Y = (abs(acc_y-128), int(acc_y), 2)
-    accelerometer_Z = (abs(acc_z-128), int(acc_z), 3)
-    accelerometer_X_Y_Z = [accelerometer_X, accelerometer_Y, accelerometer_Z]
-    accelerometer_max = max(accelerometer_X_Y_Z, key=lambda item: item[0])
-    # 陀螺仪
-    pitch_angle = math.atan2(ret2[4], math.sqrt(ret2[5] ** 2 + ret2[6] ** 2)) * (180 / math.pi)  # 计算俯仰角
-    roll_angle = math.atan2(ret2[5], math.sqrt(ret2[4] ** 2 + ret2[6] ** 2)) * (180 / math.pi)  # 计算滚转角
-    gyroscope_axes = [(abs(pitch_angle), 1 if pitch_angle > 0 else 2),  # 1, 2 : 前, 后
-                      (abs(roll_angle), 4 if roll_angle > 0 else 3)]    # 4, 3 : 右, 左
-    gyroscope_max = max(gyroscope_axes, key=lambda item: item[0])
-    # 颜色传感器
-    color_R = min(ret3[1], 255)
-    color_G = min(ret3[2], 255)
-    color_B = min(ret3[3], 255)
-
+# f0 00 00 00 00 01 2c 3c 03 4f 00 00 01 00 00 00 00 00 00 ac
+HEARTBEAT_LENGTH = 20
+HEARTBEAT_BUTTON = 1            # byte1 按钮传感器
+HEARTBEAT_TEMPERATURE = 2       # byte2 温度传感器
+HEARTBEAT_HUMIDITY = 3          # byte3 湿度传感器
+HEARTBEAT_LIGHT = 4             # byte4 光线强度
+HEARTBEAT_TILT_TYPE = 5         # byte5 倾斜类型
+HEARTBEAT_TILT_ANGLE = 6        # byte6 倾斜角度数值
+HEARTBEAT_VOICE = 7             # byte7 声音传感器
+HEARTBEAT_ACC_TYPE = 8          # byte8 加速度类型
+HEARTBEAT_ACC_VALUE = 9         # byte9 加速度数值
+HEARTBEAT_COLOR = 10            # byte10 颜色代号
+HEARTBEAT_COLOR_RED = 11        # byte11 颜色的红色值
+HEARTBEAT_COLOR_GREEN = 12      # byte12 颜色的绿色值
+HEARTBEAT_COLOR_BLUE = 13       # byte13 颜色的蓝色值
+HEARTBEAT_CHECKSUM = 19         # byte14 ~ byte18 保留，byte19 校验和
+heartbeat_packet = bytearray(HEARTBEAT_LENGTH)  # 预分配的心跳包，各字段原地更新
+heartbeat_packet[0] = 0xF0                      # byte0 心跳包标识
+heartbeat_packet[HEARTBEAT_CHECKSUM] = 0xF0
+heartbeat_sent = bytearray(HEARTBEAT_LENGTH)    # 最近一次发送的心跳包
+heartbeat_last_sent = 0
+HEARTBEAT_PERIOD_RANGE = (20, 2000)   # 检查周期可设置范围(ms)
+HEARTBEAT_IDLE_RANGE = (200, 10000)   # 空闲刷新周期可设置范围(ms)
+heartbeat_period_ms = 100             # 检查周期，字段变化最迟在一个周期内发出
+heartbeat_idle_ms = 1000              # 无变化时的刷新周期，保持连接活跃
+# 触发立即发送的字段及变化阈值
+heartbeat_thresholds = {
+    HEARTBEAT_BUTTON: 0,
+    HEARTBEAT_TILT_TYPE: 0,
+    HEARTBEAT_COLOR: 0,
+    HEARTBEAT_TILT_ANGLE: 10,
+    HEARTBEAT_ACC_TYPE: 0,
+    HEARTBEAT_ACC_VALUE: 16,
+}
+
+
+# 原地写入一个字段，同时增量更新校验和
+def _heartbeat_set(index, value):
+    value &= 0xFF
+    old = heartbeat_packet[index]
+    if old != value:
+        heartbeat_packet[index] = value
+        heartbeat_packet[HEARTBEAT_CHECKSUM] = (heartbeat_packet[HEARTBEAT_CHECKSUM] - old + value) & 0xFF
+
+
+# 加速度映射到0~255
+def _acc_level(value):
+    if value > 2048:
+        return 255
+    if value < -2048:
+        return 0
+    return min(255, (value + 2048) // 16)
+
+
+# 颜色代号
+def _color_code(color_R, color_G, color_B):
     if color_R < 50 and color_G < 50 and color_B < 50:
-        color_R_G_B = 0x01  # 黑色
+        return 0x01  # 黑色
     elif color_R > 100 and color_G < 180 and color_B > 100:
-        color_R_G_B = 0x02  # 紫色
+        return 0x02  # 紫色
     elif color_R < 50 and color_G < 100 and color_B > 70:
-        color_R_G_B = 0x03  # 蓝色
+        return 0x03  # 蓝色
     elif color_R < 30 and color_G > 70 and color_B > 50:
-        color_R_G_B = 0x04  # 青色
+        return 0x04  # 青色
     elif color_R < 100 and color_G > 150 and color_B < 100:
-        color_R_G_B = 0x05  # 绿色
+        return 0x05  # 绿色
     elif color_R > 100 and color_G > 70 and color_B < 50:
-        color_R_G_B = 0x06  # 黄色
+        return 0x06  # 黄色
     elif color_R > 100 and color_G < 60 and color_B < 60:
-        color_R_G_B = 0x07  # 红色
+        return 0x07  # 红色
     elif color_R > 200 and color_G > 200 and color_B > 200:
-        color_R_G_B = 0x08  # 白色
+        return 0x08  # 白色
+    return 0x09 if not (color_R == color_G == color_B == 0) else 0x00  # 无匹配或无信号
+
+
+# 心跳线程自有的传感器记录，快照拷贝到这里，不会被采样线程改写
+heartbeat_swat = zc_drive.new_sensor_record(zc_drive.I2C_ADDR_SWAT)
+heartbeat_g_sensor = zc_drive.new_sensor_record(zc_drive.I2C_ADDR_G_SENSOR)
+heartbeat_color = zc_drive.new_sensor_record(zc_drive.I2C_ADDR_COLOR_SENSOR)
+
+
+# 用已采样的传感器数据填充心跳包，不访问总线、不分配新的数据包
+def keepalive():
+    # 未校准时请求采样线程启动白平衡校准，心跳线程本身不访问总线
+    if zc_drive.color_calibration_state() == zc_drive.CALIBRATION_IDLE:
+        zc_drive.color_calibration_request()
+    ret1 = zc_drive.temperature_humidity_snapshot(out=heartbeat_swat)  # 温湿度传感器
+    ret2 = zc_drive.G_sensor_snapshot(out=heartbeat_g_sensor)          # 九轴传感器
+    ret3 = zc_drive.color_sensor_snapshot(out=heartbeat_color)         # 颜色传感器
+    # 加速度：取偏离中值最大的轴
+    acc_value = _acc_level(ret2[1])
+    acc_type = 1
+    for axis in (2, 3):
+        level = _acc_level(ret2[axis])
+        if abs(level - 128) > abs(acc_value - 128):
+            acc_value = level
+            acc_type = axis
+    # 陀螺仪
+    pitch_angle = math.atan2(ret2[4], math.sqrt(ret2[5] ** 2 + ret2[6] ** 2)) * (180 / math.pi)  # 计算俯仰角
+    roll_angle = math.atan2(ret2[5], math.sqrt(ret2[4] ** 2 + ret2[6] ** 2)) * (180 / math.pi)  # 计算滚转角
+    if abs(roll_angle) > abs(pitch_angle):
+        tilt_angle, tilt_type = abs(roll_angle), 4 if roll_angle > 0 else 3  # 4, 3 : 右, 左
     else:
-        color_R_G_B = 0x09 if not (color_R == color_G == color_B == 0) else 0x00  # 无匹配或无信号
-
-    # f0 00 00 00 00 01 2c 3c 03 4f 00 00 01 00 00 00 00 00 00 ac
-    msg_type = b'\xf0'                                       # byte0 心跳包标识
-    button = bytearray([get_button_ADC()])                   # byte1 按钮传感器
-    temperature = bytearray([int(ret1[2])])                  # byte2 温度传感器
-    humidity = bytearray([int(ret1[1])])                     # byte3 湿度传感器
-    Light_intensity = b'\x00'                                # byte4 光线强度
-    gyroscope_type = bytearray([int(gyroscope_max[1])])      # byte5 倾斜类型
-    gyroscope_angle = bytearray([int(gyroscope_max[0])])     # byte5 倾斜角度数值
-    voice = bytearray([random.randint(0, 90)])         # byte7 声音传感器
-    accelerometer_type = bytearray([accelerometer_max[2]])   # byte8 加速度类型
-    accelerometer_value = bytearray([accelerometer_max[1]])  # byte9 加速度数值
-    color = bytearray([color_R_G_B])                         # byte10 颜色代号
-    color_red = bytearray([color_R])                         # byte11 颜色的红色值
-    color_green = bytearray([color_G])                       # byte12 颜色的绿色值
-    color_blue = bytearray([color_B])                        # byte13 颜色的蓝色值
-    # byte0 ~ byte13 数据汇总
-    data_packet = (msg_type + button + temperature + humidity + Light_intensity + gyroscope_type
-                   + gyroscope_angle + voice + accelerometer_type + accelerometer_value + color
-                   + color_red + color_green + color_blue)
-    reserve = b'\x00\x00\x00\x00\x00'  # byte14 ~ byte18
-    checksum_msg = bytearray([(sum(data_packet) + sum(reserve)) & 0xFF])
-    state_message = data_packet + reserve + checksum_msg
-
-    return state_message
-
-
-# 更新点阵矩阵
+        tilt_angle, tilt_type = abs(pitch_angle), 1 if pitch_angle > 0 else 2  # 1, 2 : 前, 后
+    # 颜色传感器
+    color_R = max(0, min(ret3[1], 255))
+    color_G = max(0, min(ret3[2], 255))
+    color_B = max(0, min(ret3[3], 255))
+
+    _heartbeat_set(HEARTBEAT_BUTTON, get_button_ADC())
+    _heartbeat_set(HEARTBEAT_TEMPERATURE, int(ret1[2]))
+    _heartbeat_set(HEARTBEAT_HUMIDITY, int(ret1[1]))
+    _heartbeat_set(HEARTBEAT_TILT_TYPE, tilt_type)
+    _heartbeat_set(HEARTBEAT_TILT_ANGLE, int(tilt_angle))
+    _heartbeat_set(HEARTBEAT_VOICE, random.randint(0, 90))
+    _heartbeat_set(HEARTBEAT_ACC_TYPE, acc_type)
+    _heartbeat_set(HEARTBEAT_ACC_VALUE, acc_value)
+    _heartbeat_set(HEARTBEAT_COLOR, _color_code(color_R, color_G, color_B))
+    _heartbeat_set(HEARTBEAT_COLOR_RED, color_R)
+    _heartbeat_set(HEARTBEAT_COLOR_GREEN, color_G)
+    _heartbeat_set(HEARTBEAT_COLOR_BLUE, color_B)
+    return heartbeat_packet
+
+
+# 九轴原始数据流
+# 通知格式: E1 首个样本序号(2字节) 首个样本时间戳ms(4字节) 样本数(1字节) 样本...
+# 每个样本按订阅掩码依次包含加速度、陀螺仪、磁力计三轴，均为小端int16
+IMU_STREAM_OPCODE = 0xE1
+IMU_STREAM_HEADER = 8
+IMU_STREAM_MIN_PERIOD_MS = 5    # 最高采样率约200Hz，受I2C总线速度限制
+IMU_STREAM_MAX_WAIT_MS = 100    # 数据未攒满一包时最长等待时间
+IMU_STREAM_BUFFER = BLE_MTU - 3  # 按最大MTU预分配的通知缓冲区
+IMU_MASK_ALL = 0x07
+# 订阅应答: FE 状态 当前MTU(2字节小端) 校验和
+IMU_SUBSCRIBE_OK = 0x00
+IMU_SUBSCRIBE_MTU_TOO_SMALL = 0x01
+
+
+class IMU_STREAM:
+    def __init__(self):
+        self.mask = 0
+        self.period_ms = 0
+        self.next_seq = 0
+        self.record_size = 0
+        self.packet = bytearray(IMU_STREAM_BUFFER)
+        self.packet_view = memoryview(self.packet)
+        self.sample = array('i', [0] * 10)
+        self.last_send = 0
+        self.sent = 0
+        self.lost = 0  # 因发送不及时被环形缓冲区覆盖的样本数
+        self.reply_packet = bytearray(5)
+
+    def reply(self, status):
+        struct.pack_into("<BBH", self.reply_packet, 0, 0xFE, status, BLE.mtu)
+        self.reply_packet[4] = sum(self.reply_packet[:4]) & 0xFF
+        BLE.send(self.reply_packet)
+
+    def subscribe(self, period_ms, mask):
+        record_size = 6 * ((mask & 1) + (mask >> 1 & 1) + (mask >> 2 & 1))
+        if IMU_STREAM_HEADER + record_size > min(BLE.payload_size(), IMU_STREAM_BUFFER):
+            print(f"当前MTU({BLE.mtu})不足以容纳一个样本，请先协商更大的MTU")
+            self.reply(IMU_SUBSCRIBE_MTU_TOO_SMALL)
+            return False
+        self.period_ms = max(IMU_STREAM_MIN_PERIOD_MS, period_ms)
+        self.record_size = record_size
+        self.mask = mask
+        zc_drive.set_sample_period(zc_drive.I2C_ADDR_G_SENSOR, self.period_ms)
+        self.next_seq = zc_drive.sensor_ring(zc_drive.I2C_ADDR_G_SENSOR).seq
+        print(f"九轴数据订阅: {self.period_ms}ms, 掩码{mask:#04x}")
+        self.reply(IMU_SUBSCRIBE_OK)
+        return True
+
+    def unsubscribe(self):
+        if self.mask:
+            self.mask = 0
+            zc_drive.set_sample_period(zc_drive.I2C_ADDR_G_SENSOR,
+                                       zc_drive.SAMPLE_PERIOD_DEFAULT_MS[zc_drive.I2C_ADDR_G_SENSOR])
+
+    def capacity(self):
+        # 单个通知可容纳的样本数
+        return (min(BLE.payload_size(), IMU_STREAM_BUFFER) - IMU_STREAM_HEADER) // self.record_size
+
+    def step(self):
+        """把新样本打包发送，返回距下次发送的毫秒数"""
+        if not self.mask or not BLE.is_connected:
+            return IMU_STREAM_MAX_WAIT_MS
+        ring = zc_drive.sensor_ring(zc_drive.I2C_ADDR_G_SENSOR)
+        capacity = self.capacity()
+        available = ring.seq - self.next_seq
+        if available <= 0:
+            return self.period_ms
+        # 未攒满一包且距上次发送不足最长等待时间时继续等待，尽量每个通知装满
+        if available < capacity and time.ticks_diff(time.ticks_ms(), self.last_send) < IMU_STREAM_MAX_WAIT_MS:
+            return self.period_ms
+        oldest = ring.seq - ring.size
+        if self.next_seq < oldest:
+            self.lost += oldest - self.next_seq
+            self.next_seq = oldest
+        packet = self.packet
+        sample = self.sample
+        count = 0
+        offset = IMU_STREAM_HEADER
+        first_seq = self.next_seq
+        first_time = 0
+        while count < capacity:
+            timestamp = ring.get(self.next_seq, sample)
+            if timestamp is None:
+                break
+            if count == 0:
+                first_time = timestamp
+            for group in range(3):
+                if self.mask & (1 << group):
+                    base = 1 + group * 3
+                    struct.pack_into("<hhh", packet, offset, sample[base], sample[base + 1], sample[base + 2])
+                    offset += 6
+            count += 1
+            self.next_seq += 1
+        if count:
+            struct.pack_into("<BHIB", packet, 0, IMU_STREAM_OPCODE, first_seq & 0xFFFF, first_time & 0xFFFFFFFF, count)
+            if BLE.send(self.packet_view[:offset], TX_STREAM):
+                self.sent += count
+            self.last_send = time.ticks_ms()
+        if ring.seq - self.next_seq >= capacity:
+            return 1  # 还有积压，尽快发送下一包
+        return min(IMU_STREAM_MAX_WAIT_MS, self.period_ms * capacity)
+
+
+imu_stream = IMU_STREAM()
+
+
+# 创建点阵屏幕和25个格子
+def _build_dot_matrix():
+    global matrix_screen
+    screen = lv.obj()
+    bg_btn = lv.button(screen)
+    bg_btn.set_size(240, 240)
+    bg_btn.set_pos(x_start - 10, y_start - 10)
+    bg_btn.set_style_bg_color(lv.color_hex(0xCCCCCC), 0)
+    bg_btn.move_background()
+
+    btn_matrix.clear()
+    for row in range(rows):
+        row_buttons = []
+        for col in range(cols):
+            btn = lv.button(screen)
+            btn.set_size(btn_size, btn_size)
+            btn.set_pos(x_start + col * (btn_size + spacing), y_start + row * (btn_size + spacing))
+            row_buttons.append(btn)
+            matrix_colors[row][col] = -1
+        btn_matrix.append(row_buttons)
+    matrix_screen = screen
+
+
+# 更新点阵矩阵：屏幕只创建一次，之后仅重设颜色发生变化的格子
 def update_dot_matrix(binary_pattern, bright_color, dark_color):
-    global bright_color_0, dark_color_0, btn_matrix
+    global bright_color_0, dark_color_0
     bright_color_0 = bright_color
     dark_color_0 = dark_color
-    for row in btn_matrix:
-        for btn in row:
-            btn.delete()
-    btn_matrix.clear()
     try:
-        screen = lv.obj()
-        bg_btn = lv.button(screen)
-        bg_btn.set_size(240, 240)
-        bg_btn.set_pos(x_start - 10, y_start - 10)
-        bg_btn.set_style_bg_color(lv.color_hex(0xCCCCCC), 0)
-        bg_btn.move_background()
-
-        for row in range(rows):
-            row_buttons = []
-            for col in range(cols):
-                btn = lv.button(screen)
-                btn.set_size(btn_size, btn_size)
-                btn.set_pos(x_start + col * (btn_size + spacing), y_start + row * (btn_size + spacing))
-                row_buttons.append(btn)
-            btn_matrix.append(row_buttons)
-
+        if matrix_screen is None:
+            _build_dot_matrix()
         for row, binary_row in enumerate(binary_pattern):
+            rendered = matrix_colors[row]
             for col, bit in enumerate(binary_row):
-                color = lv.color_hex(bright_color_0 if bit == "1" else dark_color_0)
-                btn_matrix[row][col].set_style_bg_color(color, 0)
-
-        lv.screen_load(screen)
-        lv.task_handler()
+                color = bright_color if bit == "1" else dark_color
+                if rendered[col] != color:
+                    btn_matrix[row][col].set_style_bg_color(lv.color_hex(color), 0)
+                    rendered[col] = color
+        load_screen(matrix_screen)
     except Exception as error:
         print("点阵更新失败:", error)
 
 
+# 灯光设置 & 关闭灯光
+# 只修改灯带缓冲区，由渲染循环每帧最多写出一次
+# 蓝牙指令给出的是最终颜色，亮度恢复为100%，不沿用菜单设置的亮度
+def _on_rgb_set(rgb_port, rgb_red, rgb_green, rgb_blue):
+    if rgb_port == 0xFF:
+        rgb.fill((rgb_red, rgb_green, rgb_blue), 100)
+    else:
+        rgb.set(rgb_port, (rgb_red, rgb_green, rgb_blue), 100)
+
+
+def _on_rgb_off(rgb_port):
+    if rgb_port == 0xFF:
+        rgb.fill((0, 0, 0), 100)
+    else:
+        rgb.set(rgb_port, (0, 0, 0), 100)
+
+
+# 屏幕渲染 & 更新屏幕
+def _on_text(character_x, character_y, character_size, character_msg, character_red, character_green, character_blue):
+    character_text = character_msg.strip()
+    character_color = character_red | (character_green << 8) | (character_blue << 16)
+    ui_post("screen", show_text, character_text, character_x, character_y, character_size, character_color)
+
+
+# 长文字: E2 x y 字号 R G B 文字(UTF-8，变长) 校验和，长度由整条消息决定，超过单包时分片发送
+TEXT_LONG_OPCODE = 0xE2
+
+
+def handle_long_text(local_msg):
+    if len(local_msg) < 8:
+        print("长文字指令长度错误")
+        return
+    if sum(local_msg[:-1]) & 0xFF != local_msg[-1]:
+        print("长文字指令校验和错误")
+        return
+    character_x, character_y, character_size, character_red, character_green, character_blue = \
+        struct.unpack_from("<BBBBBB", local_msg, 1)
+    try:
+        character_msg = str(bytes(local_msg[7:-1]), "utf-8")
+    except UnicodeError:
+        print("长文字编码错误")
+        return
+    _on_text(character_x, character_y, character_size, character_msg, character_red, character_green, character_blue)
+
+
+# 旋律: E5 音符时长ms(2字节小端) 占空比(2字节小端) 音符频率(每个2字节小端，0为休止)... 校验和
+# 整段旋律交给蜂鸣器播放器依次播放，超过单包时分片发送
+MELODY_OPCODE = 0xE5
+MELODY_NOTE_MS_RANGE = (10, 5000)  # 音符时长可设置范围(ms)
+MELODY_DUTY_MAX = 1023             # ESP32 PWM占空比上限
+
+
+def handle_melody(local_msg):
+    if len(local_msg) < 8 or (len(local_msg) - 6) % 2:
+        print("旋律指令长度错误")
+        return
+    if sum(local_msg[:-1]) & 0xFF != local_msg[-1]:
+        print("旋律指令校验和错误")
+        return
+    note_ms, duty = struct.unpack_from("<HH", local_msg, 1)
+    if not MELODY_NOTE_MS_RANGE[0] <= note_ms <= MELODY_NOTE_MS_RANGE[1]:
+        print(f"旋律音符时长错误: {note_ms}ms")
+        return
+    if duty > MELODY_DUTY_MAX:
+        print(f"旋律占空比错误: {duty}")
+        return
+    count = (len(local_msg) - 6) // 2
+    notes = struct.unpack_from(f"<{count}H", local_msg, 5)
+    zc_drive.buzzer_player_play(buzzer_port, notes, note_ms, duty)
+
+
+# 诊断信息: E6 校验和，设备以 E6 + JSON文本应答，超过单包时分片发送
+def _on_diagnostics():
+    report = {
+        "ble": BLE.stats(),
+        "rx": message_queue.stats(),
+        "fragments": fragment_assembler.stats(),
+        "imu": {"sent": imu_stream.sent, "lost": imu_stream.lost},
+        "text_styles": text_style_stats(),
+        "refresher": sensor_refresher.stats(),
+    }
+    BLE.send_large(b"\xe6" + json.dumps(report).encode())
+
+
+def _on_clear_screen():
+    ui_post("screen", lambda: load_screen(toast_screen("clear", "  ")))
+
+
+# 点阵显示 & 设置点阵颜色
+def _on_matrix_pattern(matrix_port, hex_number_1, hex_number_2, hex_number_3, hex_number_4):
+    global binary_data
+    if matrix_port == 0x05:
+        binary_string_all = f"{hex_number_1:08b}{hex_number_2:08b}{hex_number_3:08b}{hex_number_4:08b}"
+        binary_data = [
+            binary_string_all[0:5],
+            binary_string_all[5:10],
+            binary_string_all[10:15],
+            binary_string_all[15:20],
+            binary_string_all[20:25],
+        ]
+        ui_post("matrix", update_dot_matrix, binary_data, bright_color_0, dark_color_0)
+
+
+def _on_matrix_color(bright_red, bright_green, bright_blue, background_red, background_green, background_blue):
+    global bright_color_0, dark_color_0
+    # 立即记录颜色，同一帧内随后到达的图案指令使用新颜色
+    bright_color_0 = bright_red | (bright_green << 8) | (bright_blue << 16)
+    dark_color_0 = background_red | (background_green << 8) | (background_blue << 16)
+    ui_post("matrix", update_dot_matrix, binary_data, bright_color_0, dark_color_0)
+
+
+# 电机设置 & 停止电机转动 & 设置电机速度
+def _on_motor_start(motor_port, motor_speed, motor_direction):
+    if motor_direction == 0x02:
+        motor_direction -= 3
+    if motor_port == 0xFF:
+        for i in range(1, 2):
+            zc_drive.start_motor(i, motor_speed * motor_direction)
+    else:
+        zc_drive.start_motor(motor_port, motor_speed * motor_direction)
+
+
+def _on_motor_stop(motor_port):
+    if motor_port == 0xFF:
+        for i in range(1, 2):
+            zc_drive.start_motor(i, 0)
+    else:
+        zc_drive.start_motor(motor_port, 0)
+
+
+def _on_motor_pair(motor_direction_M1, motor_speed_M1, motor_direction_M2, motor_speed_M2):
+    if motor_direction_M1 == 0x02:
+        motor_direction_M1 -= 3
+    if motor_direction_M2 == 0x02:
+        motor_direction_M2 -= 3
+    zc_drive.start_motor(1, motor_speed_M1 * motor_direction_M1)
+    zc_drive.start_motor(2, motor_speed_M2 * motor_direction_M2)
+
+
+# 演奏节拍 & 蜂鸣器静音
+# fa 3c 01 b8 ef
+def _on_buzzer_beat(frequency, wait, duty):
+    global buzzer_frequency, buzzer_wait, buzzer_duty
+    buzzer_frequency = frequency * 30
+    buzzer_wait = wait
+    buzzer_duty = duty
+    # 每拍响 wait/10 秒，间隔后循环，直到静音
+    zc_drive.buzzer_player_play(buzzer_port, (buzzer_frequency,), buzzer_wait * 100, buzzer_duty,
+                                BUZZER_BEAT_GAP_MS, True)
+
+
+def _on_buzzer_mute():
+    zc_drive.buzzer_player_stop()
+    zc_drive.buzzer_stop(buzzer_port)
+
+
+# 心跳设置: FD 检查周期(2字节小端) 空闲刷新周期(2字节小端) 校验和，周期单位ms，0表示不修改
+def _on_heartbeat_config(period_ms, idle_ms):
+    global heartbeat_period_ms, heartbeat_idle_ms
+    if period_ms:
+        heartbeat_period_ms = max(HEARTBEAT_PERIOD_RANGE[0], min(period_ms, HEARTBEAT_PERIOD_RANGE[1]))
+    if idle_ms:
+        heartbeat_idle_ms = max(HEARTBEAT_IDLE_RANGE[0], min(idle_ms, HEARTBEAT_IDLE_RANGE[1]))
+    print(f"心跳周期: {heartbeat_period_ms}ms, 空闲刷新: {heartbeat_idle_ms}ms")
+
+
+# 九轴原始数据订阅: FE 采样周期ms(2字节小端，0表示取消) 数据掩码 校验和
+# 掩码 bit0: 加速度 bit1: 陀螺仪 bit2: 磁力计
+# 设备以 FE 状态(0: 成功 1: MTU不足) 当前MTU(2字节小端) 校验和 应答订阅请求
+def _on_imu_subscribe(period_ms, mask):
+    if period_ms == 0 or mask & IMU_MASK_ALL == 0:
+        imu_stream.unsubscribe()
+    else:
+        imu_stream.subscribe(period_ms, mask & IMU_MASK_ALL)
+
+
+# 连接配置: E4 配置编号(0: 低延迟 1: 低功耗) 校验和
+def _on_connection_profile(profile):
+    BLE.set_profile(profile)
+
+
+def _frame(fmt, handler, checksum=True):
+    # 帧格式: 指令(1字节) + 字段 + 校验和(1字节，前面所有字节之和的低8位)
+    return 1 + struct.calcsize(fmt) + (1 if checksum else 0), fmt, handler, checksum
+
+
+# 指令分发表 指令: (帧长度, 字段格式, 处理函数, 是否带校验和)
+MESSAGE_TABLE = {
+    0xF1: _frame("<BBBB", _on_rgb_set),
+    0xF2: _frame("<B", _on_rgb_off),
+    0xF3: _frame("<BBB12sBBB", _on_text),
+    0xF4: _frame("", _on_clear_screen),
+    0xF5: _frame("<BBBBB", _on_matrix_pattern),
+    0xF6: _frame("<BBBBBB", _on_matrix_color),
+    0xF7: _frame("<BBB", _on_motor_start),
+    0xF8: _frame("<B", _on_motor_stop),
+    0xF9: _frame("<BBBB", _on_motor_pair),
+    0xFA: _frame("<BBB", _on_buzzer_beat),
+    0xFB: _frame("", _on_buzzer_mute),
+    0xFD: _frame("<HH", _on_heartbeat_config),
+    0xFE: _frame("<HB", _on_imu_subscribe),
+    0xE4: _frame("<B", _on_connection_profile),
+    0xE6: _frame("", _on_diagnostics),
+}
+
+
+def decode_frame(local_msg, offset=0):
+    """校验并解码一帧，返回(处理函数, 参数元组, 帧长度)，格式错误时返回None"""
+    message_type = local_msg[offset]
+    entry = MESSAGE_TABLE.get(message_type)
+    if entry is None:
+        print("未定义信息，请重试")
+        return None
+    length, fmt, handler, checksum = entry
+    if len(local_msg) - offset < length:
+        print(f"指令{message_type:#04x}长度错误")
+        return None
+    if checksum:
+        end = offset + length - 1
+        if sum(local_msg[offset:end]) & 0xFF != local_msg[end]:
+            print(f"指令{message_type:#04x}校验和错误")
+            return None
+    return handler, struct.unpack_from(fmt, local_msg, offset + 1), length
+
+
+# 批量帧: FC 标志 帧1 帧2 ...，各帧按分发表中的长度自定界，0x00视为结束填充
+BATCH_OPCODE = 0xFC
+BATCH_ATOMIC = 0x01  # 标志位：整组校验通过后才依次执行，任一帧错误则整组丢弃
+
+
+def _apply_frame(handler, args):
+    try:
+        handler(*args)
+    except Exception as error:
+        print("处理消息失败:", error)
+
+
+def handle_batch(local_msg):
+    if len(local_msg) < 2:
+        print("批量指令长度错误")
+        return
+    atomic = local_msg[1] & BATCH_ATOMIC
+    frames = []
+    offset = 2
+    while offset < len(local_msg) and local_msg[offset] != 0x00:
+        frame = decode_frame(local_msg, offset)
+        if frame is None:
+            # 帧长度无法确定，后续帧无法定界
+            if atomic:
+                print("批量指令格式错误，整组丢弃")
+                return
+            break
+        handler, args, length = frame
+        if atomic:
+            frames.append((handler, args))
+        else:
+            _apply_frame(handler, args)
+        offset += length
+    for handler, args in frames:
+        _apply_frame(handler, args)
+
+
 # 主要处理函数
 def handle_message(local_msg):
     if not local_msg:
         return
-    try:
-        message_type = local_msg[0]
-        # 灯光设置 & 关闭灯光
-        if message_type == 0xF1:
-            rgb_port = local_msg[1]
-            rgb_red = local_msg[2]
-            rgb_green = local_msg[3]
-            rgb_blue = local_msg[4]
-            if rgb_port == 0xFF:
-                for i in range(0, 10):
-                    rgb[i] = (rgb_red, rgb_green, rgb_blue)
-                    rgb.write()
-            else:
-                rgb[rgb_port] = (rgb_red, rgb_green, rgb_blue)
-                rgb.write()
-        elif message_type == 0xF2:
-            rgb_port = local_msg[1]
-            if rgb_port == 0xFF:
-                for i in range(0, 10):
-                    rgb[i] = (0, 0, 0)
-                    rgb.write()
-            else:
-                rgb[rgb_port] = (0, 0, 0)
-                rgb.write()
-        # 屏幕渲染 & 更新屏幕
-        elif message_type == 0xF3:
-            character_x = local_msg[1]
-            character_y = local_msg[2]
-            character_size = local_msg[3]
-            character_msg = local_msg[4:16]
-            character_red = local_msg[16]
-            character_green = local_msg[17]
-            character_blue = local_msg[18]
-            character_text = character_msg.strip()
-            character_color = character_red | (character_green << 8) | (character_blue << 16)
-            lv.screen_load(create_screen(character_text, character_x, character_y, character_size, character_color))
-            lv.task_handler()
-        elif message_type == 0xF4:
-            lv.screen_load(create_screen("  "))
-            lv.task_handler()
-        # 点阵显示 & 设置点阵颜色
-        elif message_type == 0xF5:
-            matrix_port = local_msg[1]
-            hex_number_1 = local_msg[2]
-            hex_number_2 = local_msg[3]
-            hex_number_3 = local_msg[4]
-            hex_number_4 = local_msg[5]
-            binary_string_1 = f"{hex_number_1:08b}"
-            binary_string_2 = f"{hex_number_2:08b}"
-            binary_string_3 = f"{hex_number_3:08b}"
-            binary_string_4 = f"{hex_number_4:08b}"
-            if matrix_port == 0x05:
-                global binary_data
-                binary_string_all = binary_string_1 + binary_string_2 + binary_string_3 + binary_string_4
-                binary_data_0x05 = [
-                    binary_string_all[0:5],
-                    binary_string_all[5:10],
-                    binary_string_all[10:15],
-                    binary_string_all[15:20],
-                    binary_string_all[20:25],
-                ]
-                binary_data = binary_data_0x05
-                update_dot_matrix(binary_data, bright_color_0, dark_color_0)
-        elif message_type == 0xF6:
-            global binary_data
-            bright_red = local_msg[1]
-            bright_green = local_msg[2]
-            bright_blue = local_msg[3]
-            background_red = local_msg[4]
-            background_green = local_msg[5]
-            background_blue = local_msg[6]
-            bright_light = bright_red | (bright_green << 8) | (bright_blue << 16)
-            dark_light = background_red | (background_green << 8) | (background_blue << 16)
-            update_dot_matrix(binary_data, bright_light, dark_light)
-        # 电机设置 & 停止电机转动 & 设置电机速度
-        elif message_type == 0xF7:
-            motor_port = local_msg[1]
-            motor_speed = local_msg[2]
-            motor_direction = local_msg[3]
-            if motor_direction == 0x02:
-                motor_direction -= 3
-            if motor_port == 0xFF:
-                for i in range(1, 2):
-                    zc_drive.start_motor(i, motor_speed * motor_direction)
-            else:
-                zc_drive.start_motor(motor_port, motor_speed * motor_direction)
-        elif message_type == 0xF8:
-            motor_port = local_msg[1]
-            if motor_port == 0xFF:
-                for i in range(1, 2):
-                    zc_drive.start_motor(i, 0)
-            else:
-                zc_drive.start_motor(motor_port, 0)
-        elif message_type == 0xF9:
-            motor_direction_M1 = local_msg[1]
-            motor_speed_M1 = local_msg[2]
-            motor_direction_M2 = local_msg[3]
-            motor_speed_M2 = local_msg[4]
-            if motor_direction_M1 == 0x02:
-                motor_direction_M1 -= 3
-            if motor_direction_M2 == 0x02:
-                motor_direction_M2 -= 3
-            zc_drive.start_motor(1, motor_speed_M1 * motor_direction_M1)
-            zc_drive.start_motor(2, motor_speed_M2 * motor_direction_M2)
-        # 演奏节拍 & 蜂鸣器静音
-        # fa 3c 01 b8 ef
-        elif message_type == 0xFA:
-            global buzzer_flag, buzzer_frequency, buzzer_wait, buzzer_duty
-            buzzer_frequency = local_msg[1] * 30
-            buzzer_wait = local_msg[2]
-            buzzer_duty = local_msg[3]
-            buzzer_flag = True
-        elif message_type == 0xFB:
-            global buzzer_flag
-            buzzer_flag = False
-            zc_drive.buzzer_stop(buzzer_port)
-        else:
-            print("未定义信息，请重试")
+    if local_msg[0] == FRAGMENT_OPCODE:
+        message = fragment_assembler.feed(local_msg)
+        if message is not None and message[0] != FRAGMENT_OPCODE:
+            handle_message(message)
+        return
+    if local_msg[0] == BATCH_OPCODE:
+        handle_batch(local_msg)
+        return
+    if local_msg[0] == TEXT_LONG_OPCODE:
+        handle_long_text(local_msg)
+        return
+    if local_msg[0] == MELODY_OPCODE:
+        handle_melody(local_msg)
+        return
+    frame = decode_frame(local_msg)
+    if frame is None:
+        return
+    handler, args, _ = frame
+    _apply_frame(handler, args)
 
+
+# 推进蜂鸣器播放，返回距下次推进的毫秒数
+def buzzer_step():
+    try:
+        return zc_drive.buzzer_player_step()
     except Exception as error:
-        print("处理消息失败:", error)
+        print("蜂鸣器启动失败:", error)
+        zc_drive.buzzer_player_stop()
+        return zc_drive.BUZZER_IDLE_POLL_MS
 
 
 def buzzer_loop():
     """蜂鸣器线程"""
-    global buzzer_flag, buzzer_port, buzzer_frequency, buzzer_wait, buzzer_duty
     while True:
-        if buzzer_flag:
-            try:
-                zc_drive.buzzer_start(buzzer_port, buzzer_frequency, buzzer_duty)
-                time.sleep(buzzer_wait/10)
-                zc_drive.buzzer_start(buzzer_port, buzzer_frequency, 0)
-            except Exception as error:
-                print("蜂鸣器启动失败:", error)
-        time.sleep(0.5)
+        time.sleep_ms(buzzer_step())
 
 
 def handle_message_loop():
     """处理消息的线程"""
-    global message_queue
+    msg_buf = bytearray(message_queue.slot_size)
+    msg_view = memoryview(msg_buf)
     while True:
-        with message_lock:  # 确保线程安全
-            if message_queue:
-                msg = message_queue.pop(0)
-            else:
-                msg = None
-        if msg:
+        length = message_queue.get_into(msg_buf)
+        if length:
             try:
-                handle_message(msg)
+                handle_message(msg_view[:length])
             except Exception as error:
                 print("处理消息失败:", error)
         else:
-            time.sleep(0.1)
+            # 队列为空时阻塞，直到蓝牙中断入队后唤醒
+            message_queue.wait()
+
+
+# 心跳包是否有字段的变化超过阈值
+def heartbeat_changed(packet):
+    for index, threshold in heartbeat_thresholds.items():
+        if abs(packet[index] - heartbeat_sent[index]) > threshold:
+            return True
+    return False
+
+
+# 按检查周期生成心跳包，字段变化超过阈值时立即发送，否则按空闲周期发送，返回距下次检查的毫秒数
+def send_keepalive():
+    global heartbeat_last_sent
+    if BLE.is_connected:
+        try:
+            packet = keepalive()
+            now = time.ticks_ms()
+            if heartbeat_changed(packet) or time.ticks_diff(now, heartbeat_last_sent) >= heartbeat_idle_ms:
+                # 心跳包拷贝进发送队列，尚未发出的旧心跳直接被覆盖
+                if BLE.send(packet, TX_HEARTBEAT):
+                    heartbeat_sent[:] = packet
+                    heartbeat_last_sent = now
+        except Exception as error:
+            print("发送心跳包失败:", error)
+    return heartbeat_period_ms
+
+
+def imu_stream_loop():
+    """九轴数据流线程"""
+    while True:
+        time.sleep_ms(imu_stream.step())
+
+
+def ble_tx_loop():
+    """通知发送线程"""
+    while True:
+        try:
+            wait = BLE.flush()
+        except Exception as error:
+            print("发送通知失败:", error)
+            wait = TX_RETRY_MS[1]
+        if wait:
+            time.sleep_ms(wait)
+        else:
+            # 队列为空时阻塞，直到有通知入队后唤醒
+            BLE.tx_queue.wait()
 
 
 def keepalive_loop():
     """心跳包线程"""
     while True:
-        if BLE.is_connected:
+        time.sleep_ms(send_keepalive())
+
+
+# 渲染一帧，返回本帧耗时(ms)
+def render_frame():
+    global ble_start_deadline
+    frame_start = time.ticks_ms()
+    ui_flush()
+    if ble_start_deadline is not None and time.ticks_diff(frame_start, ble_start_deadline) >= 0:
+        ble_start_deadline = None
+        BLE.start_connecting()
+    if BLE.status_toast:
+        load_screen(toast_screen(BLE.status_toast))
+        BLE.status_toast = None
+    if not toast_pending():
+        try:
+            handle_buttons()
+        except Exception as error:
+            # 按键处理出错只影响这一次操作，渲染线程继续处理蓝牙命令和刷新
+            print("按键处理失败:", error)
+    rgb.flush()
+    lv.task_handler()
+    return time.ticks_diff(time.ticks_ms(), frame_start)
+
+
+def render_loop():
+    """渲染线程：唯一操作LVGL的线程，处理按键和界面命令，每帧刷新一次屏幕"""
+    while True:
+        try:
+            elapsed = render_frame()
+        except Exception as error:
+            print("渲染失败:", error)
+            elapsed = 0
+        time.sleep_ms(max(1, UI_FRAME_MS - elapsed))
+
+
+################################asyncio协作式调度###################################
+async def buzzer_task():
+    while True:
+        await asyncio.sleep_ms(buzzer_step())
+
+
+async def handle_message_task():
+    msg_buf = bytearray(message_queue.slot_size)
+    msg_view = memoryview(msg_buf)
+    message_queue.flag = asyncio.ThreadSafeFlag()
+    while True:
+        length = message_queue.get_into(msg_buf)
+        if length:
             try:
-                BLE.send(keepalive())
+                handle_message(msg_view[:length])
             except Exception as error:
-                print("发送心跳包失败:", error)
-        time.sleep(1)
+                print("处理消息失败:", error)
+            await asyncio.sleep_ms(0)  # 让出执行权，避免连续消息饿死其他任务
+        else:
+            # 蓝牙中断入队时设置标志唤醒
+            await message_queue.flag.wait()
 
 
-def button_loop():
-    """按键处理线程"""
+async def imu_stream_task():
     while True:
-        handle_buttons()
-        lv.task_handler()
-        time.sleep(0.05)
+        await asyncio.sleep_ms(imu_stream.step())
 
 
-BLE = ESP32_BLE("编程积木")
-_thread.stack_size(8192)
-_thread.start_new_thread(button_loop, ())
-_thread.start_new_thread(buzzer_loop, ())
-_thread.start_new_thread(keepalive_loop, ())
-_thread.start_new_thread(handle_message_loop, ())
+async def ble_tx_task():
+    BLE.tx_queue.flag = asyncio.ThreadSafeFlag()
+    while True:
+        try:
+            wait = BLE.flush()
+        except Exception as error:
+            print("发送通知失败:", error)
+            wait = TX_RETRY_MS[1]
+        if wait:
+            await asyncio.sleep_ms(wait)
+        else:
+            await BLE.tx_queue.flag.wait()
 
 
+async def keepalive_task():
+    while True:
+        await asyncio.sleep_ms(send_keepalive())
 
+
+async def sampler_task():
+    sampler = zc_drive.SENSOR_SAMPLER()
+    sampler.running = True
+    sampler.alive = True
+    try:
+        while sampler.running:
+            await asyncio.sleep_ms(sampler.step())
+    finally:
+        sampler.alive = False
+
+
+async def render_task():
+    while True:
+        try:
+            elapsed = render_frame()
+        except Exception as error:
+            print("渲染失败:", error)
+            elapsed = 0
+        await asyncio.sleep_ms(max(1, UI_FRAME_MS - elapsed))
+
+
+async def async_main():
+    asyncio.create_task(sampler_task())
+    asyncio.create_task(buzzer_task())
+    asyncio.create_task(keepalive_task())
+    asyncio.create_task(imu_stream_task())
+    asyncio.create_task(handle_message_task())
+    asyncio.create_task(ble_tx_task())
+    await render_task()
+
+
+BLE = ESP32_BLE("编程积木")
+keypad.start()
+if USE_ASYNCIO:
+    asyncio.run(async_main())
+else:
+    _thread.stack_size(8192)
+    zc_drive.start_sampler()
+    _thread.start_new_thread(render_loop, ())
+    _thread.start_new_thread(buzzer_loop, ())
+    _thread.start_new_thread(keepalive_loop, ())
+    _thread.start_new_thread(imu_stream_loop, ())
+    _thread.start_new_thread(handle_message_loop, ())
+    _thread.start_new_thread(ble_tx_loop, ())
@@ -1,4 +1,7 @@
 from machine import ADC, Pin, PWM, I2C, SoftI2C
+from array import array
+import _thread
+import struct
 import time
 
 
@@ -171,6 +174,94 @@ def buzzer_play(port, melodies, wait, duty):  # 定义播放的音乐，等待
     bz.pwm.duty(0)
 
 
+BUZZER_IDLE_POLL_MS = 50  # 播放器空闲时的检查间隔，新的播放请求最迟在此时间内开始
+BUZZER_NOTE_GAP_MS = 10   # 音符之间的停顿
+
+
+class BUZZER_PLAYER:  # 单例实现，非阻塞的旋律播放器，由蜂鸣器线程或任务反复调用step()推进
+    def __init__(self):
+        if not hasattr(self, 'notes'):
+            self.port = None
+            self.notes = ()      # 各音符的频率，0表示休止
+            self.index = 0
+            self.note_ms = 0     # 每个音符的时长
+            self.gap_ms = BUZZER_NOTE_GAP_MS
+            self.duty = 0
+            self.loop = False    # 播放完后是否从头循环
+            self.sounding = False
+            self.next_time = 0
+            self.lock = _thread.allocate_lock()
+
+    def __new__(cls, *args, **kwargs):
+        if not hasattr(cls, '_instance'):
+            BUZZER_PLAYER._instance = super().__new__(cls)
+        return BUZZER_PLAYER._instance
+
+    def _silence(self):
+        if self.sounding:
+            BUZZER(self.port).pwm.duty(0)
+            self.sounding = False
+
+    def play(self, port, notes, note_ms, duty, gap_ms=BUZZER_NOTE_GAP_MS, loop=False):
+        with self.lock:
+            self._silence()
+            self.port = port
+            self.notes = notes
+            self.note_ms = note_ms
+            self.gap_ms = gap_ms
+            self.duty = duty
+            self.loop = loop
+            self.index = 0
+            self.next_time = time.ticks_ms()
+
+    def stop(self):
+        with self.lock:
+            self._silence()
+            self.notes = ()
+            self.index = 0
+
+    def playing(self):
+        return self.index < len(self.notes)
+
+    def step(self):
+        """推进播放，返回距下一次调用的毫秒数"""
+        with self.lock:
+            if self.index >= len(self.notes):
+                return BUZZER_IDLE_POLL_MS
+            now = time.ticks_ms()
+            due = time.ticks_diff(self.next_time, now)
+            if due > 0:
+                return min(due, BUZZER_IDLE_POLL_MS)
+            note = self.notes[self.index]
+            if self.sounding or note == 0:
+                # 音符结束后停顿，休止符占用一个音符的时长
+                self._silence()
+                self.index += 1
+                if self.index >= len(self.notes) and self.loop:
+                    self.index = 0
+                wait = self.gap_ms if note else self.note_ms
+                self.next_time = time.ticks_add(now, wait)
+                return min(wait, BUZZER_IDLE_POLL_MS)
+            bz = BUZZER(self.port)
+            bz.pwm.freq(note)
+            bz.pwm.duty(self.duty)
+            self.sounding = True
+            self.next_time = time.ticks_add(now, self.note_ms)
+            return min(self.note_ms, BUZZER_IDLE_POLL_MS)
+
+
+def buzzer_player_play(port, notes, note_ms, duty, gap_ms=BUZZER_NOTE_GAP_MS, loop=False):
+    BUZZER_PLAYER().play(port, notes, note_ms, duty, gap_ms, loop)
+
+
+def buzzer_player_stop():
+    BUZZER_PLAYER().stop()
+
+
+def buzzer_player_step():
+    return BUZZER_PLAYER().step()
+
+
 ########################I2C设备定义###########################
 SENSOR_MAP = {
     0x07: "颜色传感器",
@@ -182,12 +273,51 @@ I2C_ADDR_SWAT = 0xC2 >> 1
 I2C_ADDR_COLOR_SENSOR = 0xC4 >> 1
 I2C_ADDR_G_SENSOR = 0xC6 >> 1
 
+I2C_RESCAN_INTERVAL_MS = 5000  # 后台重新扫描总线的间隔，用于发现开机后插入的模块
+I2C_BACKEND = "hard"           # "hard": 硬件I2C外设, "soft": SoftI2C软件模拟
+I2C_FREQ = 400000              # 总线频率，最高支持快速模式400kHz
+I2C_FALLBACK_FREQ = 100000     # 模块在高速下无应答时回退的频率
+I2C_MAX_FREQ = 400000
+
+
+def _build_i2c_bus(backend, freq):
+    if backend == "hard":
+        return I2C(0, scl=Pin(40), sda=Pin(41), freq=freq, timeout=50000)
+    return SoftI2C(scl=Pin(40), sda=Pin(41), freq=freq, timeout=50000)
+
 
 class ZC_I2C:
     def __init__(self):
         if not hasattr(self, 'i2c'):
-            self.i2c = SoftI2C(scl=Pin(40), sda=Pin(41), freq=100000, timeout=50000)
+            self.validated = {}  # 已通过握手校验的设备 addr: sensor_num
+            self.slow_devices = set()  # 只能在回退频率下通信的设备
+            # 总线访问锁：每次传输和重建总线时持有，避免采样线程的传输被重建打断
+            self.lock = _thread.allocate_lock()
+            self.configure(I2C_BACKEND, I2C_FREQ)
+
+    def configure(self, backend, freq):
+        if backend not in ("hard", "soft"):
+            raise ValueError("I2C后端名称错误，需为\"hard\"或者\"soft\"")
+        if not isinstance(freq, int) or freq <= 0 or freq > I2C_MAX_FREQ:
+            raise ValueError("I2C频率需为1~400000之间的int整型")
+        self.target_freq = freq  # 期望的总线频率，回退后条件允许时恢复
+        self.slow_devices.clear()
+        self._rebuild(backend, freq)
+
+    def _rebuild(self, backend, freq):
+        with self.lock:
+            try:
+                self.i2c = _build_i2c_bus(backend, freq)
+            except Exception as e:
+                # 硬件外设不可用时退回软件模拟
+                print(f"I2C后端{backend}初始化失败: {e}, 使用soft")
+                backend = "soft"
+                self.i2c = _build_i2c_bus(backend, freq)
+            self.backend = backend
+            self.freq = freq
+            self.validated.clear()
             self.slaves_list = self.i2c.scan()
+            self.last_scan = time.ticks_ms()
 
     def __new__(cls, *args, **kwargs):
         if not hasattr(cls, '_instance'):
@@ -195,65 +325,269 @@ class ZC_I2C:
             ZC_I2C._instance = super().__new__(cls)
         return ZC_I2C._instance
 
-    def init(self, addr, sensor_num):
+    def rescan(self):
         try:
+            with self.lock:
+                self.slaves_list = self.i2c.scan()
+        except Exception as e:
+            print(f"总线扫描错误: {e}")
+            return
+        self.last_scan = time.ticks_ms()
+        # 已拔出的设备移出登记表，下次插入时重新握手
+        for addr in list(self.validated):
+            if addr not in self.slaves_list:
+                del self.validated[addr]
+        for addr in list(self.slow_devices):
             if addr not in self.slaves_list:
+                self.slow_devices.discard(addr)
+        # 需要低速的设备都已拔出，恢复期望频率
+        if not self.slow_devices and self.freq != self.target_freq:
+            print(f"I2C恢复到{self.target_freq}Hz")
+            self._rebuild(self.backend, self.target_freq)
+
+    def maybe_rescan(self):
+        if time.ticks_diff(time.ticks_ms(), self.last_scan) >= I2C_RESCAN_INTERVAL_MS:
+            self.rescan()
+
+    def invalidate(self, addr):
+        # 读取出错后调用，下次访问该设备时重新握手
+        self.validated.pop(addr, None)
+
+    def init(self, addr, sensor_num):
+        # 快速路径：已校验的设备不再重复握手
+        if self.validated.get(addr) == sensor_num:
+            return True
+        if addr not in self.slaves_list:
+            self.maybe_rescan()
+        if not self.validate(addr, sensor_num):
+            return False
+        self.validated[addr] = sensor_num
+        return True
+
+    def _handshake(self, addr):
+        with self.lock:
+            return self.i2c.readfrom_mem(addr, 0x88, 5)
+
+    def validate(self, addr, sensor_num):
+        if addr not in self.slaves_list:
+            return False
+        try:
+            data = self._handshake(addr)
+        except OSError as e:
+            if self.freq <= I2C_FALLBACK_FREQ:
+                print(f"初始化错误: {e}")
                 return False
-            data = self.i2c.readfrom_mem(addr, 0x88, 5)
-            if data[0] != 0x88 or data[1] != 0x03:
-                print("模块外接传感器无响应")
+            # 高速下无应答，降频重试一次；低速也失败说明模块已拔出，恢复原频率
+            high_freq = self.freq
+            self._rebuild(self.backend, I2C_FALLBACK_FREQ)
+            try:
+                data = self._handshake(addr)
+            except OSError:
+                print(f"初始化错误: {e}")
+                self._rebuild(self.backend, high_freq)
                 return False
-            if data[2] != 1:
-                print("模块外接传感器初始化失败")
+            print(f"模块{addr:#04x}在{high_freq}Hz下无应答，回退到{I2C_FALLBACK_FREQ}Hz")
+            self.slow_devices.add(addr)
+        if data[0] != 0x88 or data[1] != 0x03:
+            print("模块外接传感器无响应")
+            return False
+        if data[2] != 1:
+            print("模块外接传感器初始化失败")
+            return False
+        if sensor_num != data[3]:
+            s1 = SENSOR_MAP.get(sensor_num, "未知设备")
+            s2 = SENSOR_MAP.get(data[3], "未知设备")
+            print(f"模块外接传感器类型错误,期望:{s1}, 模块返回:{s2}")
+            return False
+        return True
+
+
+def i2c_benchmark(addr=I2C_ADDR_G_SENSOR, reg=0x08, nbytes=21, count=100,
+                  configs=(("hard", 400000), ("hard", 100000), ("soft", 400000), ("soft", 100000))):
+    """对比不同后端和频率下的吞吐量(bytes/s)和单次事务延迟(us)，测试结束后恢复原配置"""
+    device = ZC_I2C()
+    old_backend, old_freq = device.backend, device.target_freq
+    buf = bytearray(nbytes)
+    results = []
+    try:
+        for backend, freq in configs:
+            device.configure(backend, freq)
+            if device.backend != backend:
+                print(f"{backend} @ {freq}Hz: 后端不可用")
+                continue
+            try:
+                start = time.ticks_us()
+                with device.lock:
+                    for _ in range(count):
+                        device.i2c.readfrom_mem_into(addr, reg, buf)
+                elapsed = time.ticks_diff(time.ticks_us(), start)
+            except OSError as e:
+                print(f"{backend} @ {freq}Hz: 读取失败 {e}")
+                continue
+            latency_us = elapsed // count
+            bytes_per_s = nbytes * count * 1000000 // max(1, elapsed)
+            print(f"{backend} @ {freq}Hz: {bytes_per_s} bytes/s, {latency_us} us/事务")
+            results.append((backend, freq, bytes_per_s, latency_us))
+    finally:
+        device.configure(old_backend, old_freq)
+    return results
+
+
+####################颜色光线传感器############################
+COLOR_CALIBRATION_MS = 10000  # 白平衡校准所需时间
+CALIBRATION_IDLE = 0
+CALIBRATION_RUNNING = 1
+CALIBRATION_SUCCESS = 2
+CALIBRATION_FAILED = 3
+COLOR_NOT_CALIBRATED = -1  # 未校准时颜色记录的状态位
+
+
+class COLOR_CALIBRATION:  # 单例实现，非阻塞的白平衡校准状态机
+    def __init__(self):
+        if not hasattr(self, 'state'):
+            self.state = CALIBRATION_IDLE
+            self.start_time = 0
+            self.requested = False  # 待采样线程执行的校准请求
+            self.lock = _thread.allocate_lock()
+
+    def __new__(cls, *args, **kwargs):
+        if not hasattr(cls, '_instance'):
+            COLOR_CALIBRATION._instance = super().__new__(cls)
+        return COLOR_CALIBRATION._instance
+
+    def start(self):
+        with self.lock:
+            if self.state == CALIBRATION_RUNNING:
+                return True
+            device = ZC_I2C()
+            if not device.init(I2C_ADDR_COLOR_SENSOR, 0x07):
+                self.state = CALIBRATION_FAILED
                 return False
-            if sensor_num != data[3]:
-                s1 = SENSOR_MAP.get(sensor_num, "未知设备")
-                s2 = SENSOR_MAP.get(data[3], "未知设备")
-                print(f"模块外接传感器类型错误,期望:{s1}, 模块返回:{s2}")
+            print("开始白平衡校准")
+            try:
+                with device.lock:
+                    device.i2c.writeto(I2C_ADDR_COLOR_SENSOR, bytearray([0x87, 0x02, 0xAA, 0x33]))  # IIC地址，数据
+            except Exception as e:
+                print(f"白平衡校准启动失败: {e}")
+                device.invalidate(I2C_ADDR_COLOR_SENSOR)
+                self.state = CALIBRATION_FAILED
                 return False
+            self.start_time = time.ticks_ms()
+            self.state = CALIBRATION_RUNNING
             return True
-        except Exception as e:
-            print(f"初始化错误: {e}")
-            return False
+
+    def poll(self):
+        with self.lock:
+            if self.state != CALIBRATION_RUNNING:
+                return self.state
+            if time.ticks_diff(time.ticks_ms(), self.start_time) < COLOR_CALIBRATION_MS:
+                return self.state
+            device = ZC_I2C()
+            try:
+                with device.lock:
+                    data = device.i2c.readfrom_mem(I2C_ADDR_COLOR_SENSOR, 0x87, 6)  # IIC地址，寄存器地址，读取几个字节
+                success = data[2] == 0x00
+            except Exception as e:
+                print(f"白平衡校准结果读取失败: {e}")
+                device.invalidate(I2C_ADDR_COLOR_SENSOR)
+                success = False
+            if success:
+                print("校准成功\n\n")
+                self.state = CALIBRATION_SUCCESS
+            else:
+                print("校准失败\n\n")
+                self.state = CALIBRATION_FAILED
+            return self.state
+
+    def request(self):
+        # 只登记请求，不访问总线；由采样线程在service()中启动校准
+        self.requested = True
+
+    def service(self):
+        """采样线程调用：执行待处理的校准请求并检查校准结果"""
+        if self.requested:
+            self.requested = False
+            if self.state != CALIBRATION_RUNNING and self.state != CALIBRATION_SUCCESS:
+                self.start()
+        return self.poll()
+
+    def progress(self):
+        # 校准进度百分比
+        if self.state == CALIBRATION_SUCCESS:
+            return 100
+        if self.state != CALIBRATION_RUNNING:
+            return 0
+        elapsed = time.ticks_diff(time.ticks_ms(), self.start_time)
+        return min(99, elapsed * 100 // COLOR_CALIBRATION_MS)
+
+    def calibrated(self):
+        return self.state == CALIBRATION_SUCCESS
+
+
+def color_calibration_start():
+    return COLOR_CALIBRATION().start()
+
+
+def color_calibration_poll():
+    return COLOR_CALIBRATION().poll()
+
+
+def color_calibration_request():
+    COLOR_CALIBRATION().request()
+
+
+def color_calibration_state():
+    # 当前校准状态，不访问总线
+    return COLOR_CALIBRATION().state
+
+
+def color_calibration_progress():
+    return COLOR_CALIBRATION().progress()
+
+
+def color_calibrated():
+    return COLOR_CALIBRATION().calibrated()
 
 
-####################颜色光线传感器############################
 def color_sensor_init():
-    device = ZC_I2C()
-    ret = device.init(I2C_ADDR_COLOR_SENSOR, 0x07)
-    if not ret:
-        return False
-    print("开始白平衡校准")
-    data = bytearray([0x87, 0x02, 0xAA, 0x33])
-    device.i2c.writeto(I2C_ADDR_COLOR_SENSOR, data)  # IIC地址，数据
-    time.sleep(10)
-    data = device.i2c.readfrom_mem(I2C_ADDR_COLOR_SENSOR, 0x87, 6)  # IIC地址，寄存器地址，读取几个字节
-    if data[2] == 0x00:
-        print("校准成功\n\n")
-        return True
-    else:
-        print("校准失败\n\n")
+    # 阻塞式校准，保留给脚本直接调用；界面和心跳使用上面的非阻塞接口
+    if not color_calibration_start():
         return False
+    while color_calibration_poll() == CALIBRATION_RUNNING:
+        time.sleep_ms(100)
+    return color_calibrated()
+
+
+# 预分配的读缓冲区和结果记录，轮询时不再产生新对象
+_color_buf = bytearray(11)
+_color_record = array('i', [0, 0, 0, 0])  # 状态, R, G, B
 
 
 def color_sensor_get_rgb():
     device = ZC_I2C()
+    record = _color_record
+    if I2C_ADDR_COLOR_SENSOR not in device.slaves_list:
+        device.maybe_rescan()
+        return _clear_record(record)
+    if not color_calibrated():
+        # 校准完成前不读取数据，直接报告未校准
+        _clear_record(record)
+        record[0] = COLOR_NOT_CALIBRATED
+        return record
     try:
-        data = device.i2c.readfrom_mem(I2C_ADDR_COLOR_SENSOR, 0x07, 0x0B)  # IIC地址，寄存器地址，读取几个字节
-        hex_bytes = [f'{byte:02x}' for byte in data]
-        print(hex_bytes)
-        menu_RGB_data = [0, 0, 0]
-        menu_C_data = ((data[-9] << 8) & 0xff00) + data[-8]
-        menu_RGB_data[0] = ((data[-7] << 8) & 0xff00) + data[-6]
-        menu_RGB_data[1] = ((data[-5] << 8) & 0xff00) + data[-4]
-        menu_RGB_data[2] = ((data[-3] << 8) & 0xff00) + data[-2]
-        decrease_data = max(1, max(menu_RGB_data) // 255 + 1)
-        menu_RGB_data = [value // decrease_data for value in menu_RGB_data]
-        menu_RGB_data.insert(0, 1)
-        return menu_RGB_data
-
+        with device.lock:
+            device.i2c.readfrom_mem_into(I2C_ADDR_COLOR_SENSOR, 0x07, _color_buf)  # IIC地址，寄存器地址，读取缓冲区
+        # byte2~9: C、R、G、B 四个无符号大端16位数，C未使用
+        red, green, blue = struct.unpack_from('>3H', _color_buf, 4)
+        decrease_data = max(1, max(red, green, blue) // 255 + 1)
+        record[0] = 1
+        record[1] = red // decrease_data
+        record[2] = green // decrease_data
+        record[3] = blue // decrease_data
     except Exception as error:
-        return [0, 0, 0, 0]
+        device.invalidate(I2C_ADDR_COLOR_SENSOR)
+        record[0] = record[1] = record[2] = record[3] = 0
+    return record
 
 
 ###################加速度传感器############################
@@ -267,31 +601,56 @@ def process_short_int_data(byte1, byte2):
     return value
 
 
+_g_sensor_buf = bytearray(21)
+_g_sensor_record = array('i', [0] * 10)  # 状态, aX, aY, aZ, gsX, gsY, gsZ, gmX, gmY, gmZ
+
+
+def _clear_record(record):
+    for i in range(len(record)):
+        record[i] = 0
+    return record
+
+
 def G_sensor_get_data():
     device = ZC_I2C()
+    record = _g_sensor_record
     ret = device.init(I2C_ADDR_G_SENSOR, 0x08)
     if not ret:
-        return 0, 0, 0, 0, 0, 0, 0, 0, 0, 0
-    data = device.i2c.readfrom_mem(I2C_ADDR_G_SENSOR, 0x08, 21)  # IIC地址，寄存器地址，读取几个字节
-    aX = process_short_int_data(data[2], data[3])
-    aY = process_short_int_data(data[4], data[5])
-    aZ = process_short_int_data(data[6], data[7])
-    gsX = process_short_int_data(data[8], data[9])
-    gsY = process_short_int_data(data[10], data[11])
-    gsZ = process_short_int_data(data[12], data[13])
-    gmX = process_short_int_data(data[14], data[15])
-    gmY = process_short_int_data(data[16], data[17])
-    gmZ = process_short_int_data(data[18], data[19])
-    return 1, aX, aY, aZ, gsX, gsY, gsZ, gmX, gmY, gmZ
+        return _clear_record(record)
+    try:
+        with device.lock:
+            device.i2c.readfrom_mem_into(I2C_ADDR_G_SENSOR, 0x08, _g_sensor_buf)  # IIC地址，寄存器地址，读取缓冲区
+    except Exception as e:
+        print(f"九轴传感器读取错误: {e}")
+        device.invalidate(I2C_ADDR_G_SENSOR)
+        return _clear_record(record)
+    # byte2~19: 加速度、陀螺仪、磁力计各三轴，有符号大端16位数
+    values = struct.unpack_from('>9h', _g_sensor_buf, 2)
+    record[0] = 1
+    for i in range(9):
+        record[i + 1] = values[i]
+    return record
 
 
 ###################温度湿度传感器驱动############################
+_swat_buf = bytearray(7)
+_swat_record = array('f', [0, 0, 0])  # 状态, 湿度, 温度
+
+
 def get_temperature_humidity():
     device = ZC_I2C()
+    record = _swat_record
     ret = device.init(I2C_ADDR_SWAT, 0x0B)
     if not ret:
-        return 0, 0, 0
-    data = device.i2c.readfrom_mem(I2C_ADDR_SWAT, 0x0B, 7)  # IIC地址，寄存器地址，读取几个字节
+        return _clear_record(record)
+    try:
+        with device.lock:
+            device.i2c.readfrom_mem_into(I2C_ADDR_SWAT, 0x0B, _swat_buf)  # IIC地址，寄存器地址，读取缓冲区
+    except Exception as e:
+        print(f"温湿度传感器读取错误: {e}")
+        device.invalidate(I2C_ADDR_SWAT)
+        return _clear_record(record)
+    data = _swat_buf
     humidity = data[2] + data[3] / 100.0
     temperature_decimal = data[5]
     if temperature_decimal & 0x80:
@@ -299,6 +658,245 @@ def get_temperature_humidity():
         temperature = - (data[4] + temperature_decimal / 100.0)
     else:
         temperature = data[4] + temperature_decimal / 100.0
-    return 1, humidity, temperature
+    record[0] = 1
+    record[1] = humidity
+    record[2] = temperature
+    return record
+
+
+########################传感器快照缓存###########################
+# 每个设备快照的最大有效时间(ms)，超过则重新读取总线
+SENSOR_MAX_AGE_MS = {
+    I2C_ADDR_G_SENSOR: 100,
+    I2C_ADDR_COLOR_SENSOR: 200,
+    I2C_ADDR_SWAT: 1000,
+}
+# 各设备数据记录的长度和类型，与驱动函数返回的记录一致
+SENSOR_RECORD_LAYOUT = {
+    I2C_ADDR_G_SENSOR: (10, 'i'),
+    I2C_ADDR_COLOR_SENSOR: (4, 'i'),
+    I2C_ADDR_SWAT: (3, 'f'),
+}
+
+
+def new_sensor_record(addr):
+    # 新建一个调用方自有的记录，用于接收快照
+    width, typecode = SENSOR_RECORD_LAYOUT[addr]
+    return array(typecode, [0] * width)
+
+
+def _copy_record(src, out):
+    for i in range(len(out)):
+        out[i] = src[i]
+    return out
+
+
+class SENSOR_CACHE:  # 单例实现
+    def __init__(self):
+        if not hasattr(self, 'snapshots'):
+            self.snapshots = {}  # addr: [读取时刻ticks_ms, 数据记录的拷贝]
+            self.lock = _thread.allocate_lock()
+
+    def __new__(cls, *args, **kwargs):
+        if not hasattr(cls, '_instance'):
+            SENSOR_CACHE._instance = super().__new__(cls)
+        return SENSOR_CACHE._instance
+
+    def get(self, addr, reader, max_age_ms=None, out=None):
+        """把最新数据拷贝到调用方的记录out并返回，out为None时新建一个；返回的记录不会被后续采样改写"""
+        if out is None:
+            out = new_sensor_record(addr)
+        sampler = SENSOR_SAMPLER()
+        if sampler.running and addr in sampler.rings:
+            # 后台采样运行时在环形缓冲区的锁内拷贝最新样本，不访问总线
+            sampler.rings[addr].latest(out)
+            return out
+        if max_age_ms is None:
+            max_age_ms = SENSOR_MAX_AGE_MS.get(addr, 0)
+        # 读取期间持锁，并发的消费者等待同一次读取结果，而不是各自再读一次总线
+        with self.lock:
+            snapshot = self.snapshots.get(addr)
+            if snapshot is None or time.ticks_diff(time.ticks_ms(), snapshot[0]) >= max_age_ms:
+                if snapshot is None:
+                    snapshot = self.snapshots[addr] = [0, new_sensor_record(addr)]
+                # 驱动返回的是共享记录，下一次直接读取会覆盖，缓存时保存拷贝
+                _copy_record(reader(), snapshot[1])
+                snapshot[0] = time.ticks_ms()
+            return _copy_record(snapshot[1], out)
+
+    def invalidate(self, addr=None):
+        with self.lock:
+            if addr is None:
+                self.snapshots.clear()
+            else:
+                self.snapshots.pop(addr, None)
+
+
+def set_sensor_max_age(addr, max_age_ms):
+    if not isinstance(max_age_ms, int) or max_age_ms < 0:
+        raise ValueError("max_age_ms需为大于等于0的int整型")
+    SENSOR_MAX_AGE_MS[addr] = max_age_ms
+
+
+def G_sensor_snapshot(max_age_ms=None, out=None):
+    return SENSOR_CACHE().get(I2C_ADDR_G_SENSOR, G_sensor_get_data, max_age_ms, out)
+
+
+def color_sensor_snapshot(max_age_ms=None, out=None):
+    return SENSOR_CACHE().get(I2C_ADDR_COLOR_SENSOR, color_sensor_get_rgb, max_age_ms, out)
+
+
+def temperature_humidity_snapshot(max_age_ms=None, out=None):
+    return SENSOR_CACHE().get(I2C_ADDR_SWAT, get_temperature_humidity, max_age_ms, out)
+
+
+########################后台传感器采样###########################
+SAMPLE_RING_SIZE = 32  # 每个设备保留的历史样本数
+# 各设备的采样周期(ms)
+SAMPLE_PERIOD_MS = {
+    I2C_ADDR_G_SENSOR: 20,
+    I2C_ADDR_COLOR_SENSOR: 100,
+    I2C_ADDR_SWAT: 1000,
+}
+SAMPLE_PERIOD_DEFAULT_MS = dict(SAMPLE_PERIOD_MS)  # 默认采样周期，临时修改后据此恢复
+
+
+class SAMPLE_RING:
+    """定长环形缓冲区，时间戳和数据都存放在预分配的array中"""
+    def __init__(self, width, typecode='i', size=SAMPLE_RING_SIZE):
+        self.width = width
+        self.size = size
+        self.timestamps = array('i', [0] * size)
+        self.data = array(typecode, [0] * (size * width))
+        self.last = array(typecode, [0] * width)  # 最新样本，由采样线程改写，消费者应通过latest()拷贝读取
+        self.last_time = 0
+        self.seq = 0  # 已写入的样本总数，消费者可据此判断是否有新样本或丢样
+        self.lock = _thread.allocate_lock()
+
+    def push(self, timestamp, record):
+        with self.lock:
+            index = self.seq % self.size
+            base = index * self.width
+            for i in range(self.width):
+                self.data[base + i] = record[i]
+                self.last[i] = record[i]
+            self.timestamps[index] = timestamp
+            self.last_time = timestamp
+            self.seq += 1
+
+    def count(self):
+        return min(self.seq, self.size)
+
+    def latest(self, out):
+        """把最新样本拷贝到out，返回其时间戳"""
+        with self.lock:
+            for i in range(self.width):
+                out[i] = self.last[i]
+            return self.last_time
+
+    def get(self, seq, out):
+        """把序号为seq的样本拷贝到out，返回其时间戳；样本已被覆盖或尚未写入时返回None"""
+        with self.lock:
+            if seq >= self.seq or seq < self.seq - self.size:
+                return None
+            index = seq % self.size
+            base = index * self.width
+            for i in range(self.width):
+                out[i] = self.data[base + i]
+            return self.timestamps[index]
+
+    def window(self, n):
+        """返回最近n个样本[(时间戳, 数据元组), ...]，从旧到新"""
+        with self.lock:
+            n = min(n, self.count())
+            result = []
+            for seq in range(self.seq - n, self.seq):
+                index = seq % self.size
+                base = index * self.width
+                result.append((self.timestamps[index], tuple(self.data[base:base + self.width])))
+            return result
+
+
+class SENSOR_SAMPLER:  # 单例实现
+    def __init__(self):
+        if not hasattr(self, 'rings'):
+            self.running = False
+            self.alive = False
+            # addr: [读取函数, 采样周期ms, 下次采样时刻]
+            self.devices = {
+                I2C_ADDR_G_SENSOR: [G_sensor_get_data, SAMPLE_PERIOD_MS[I2C_ADDR_G_SENSOR], 0],
+                I2C_ADDR_COLOR_SENSOR: [color_sensor_get_rgb, SAMPLE_PERIOD_MS[I2C_ADDR_COLOR_SENSOR], 0],
+                I2C_ADDR_SWAT: [get_temperature_humidity, SAMPLE_PERIOD_MS[I2C_ADDR_SWAT], 0],
+            }
+            self.rings = {
+                I2C_ADDR_G_SENSOR: SAMPLE_RING(*SENSOR_RECORD_LAYOUT[I2C_ADDR_G_SENSOR]),
+                I2C_ADDR_COLOR_SENSOR: SAMPLE_RING(*SENSOR_RECORD_LAYOUT[I2C_ADDR_COLOR_SENSOR]),
+                I2C_ADDR_SWAT: SAMPLE_RING(*SENSOR_RECORD_LAYOUT[I2C_ADDR_SWAT]),
+            }
+
+    def __new__(cls, *args, **kwargs):
+        if not hasattr(cls, '_instance'):
+            SENSOR_SAMPLER._instance = super().__new__(cls)
+        return SENSOR_SAMPLER._instance
+
+    def sample_due(self):
+        """采样所有到期的设备，返回距离下一次采样的毫秒数"""
+        wait = 1000
+        for addr, entry in self.devices.items():
+            reader, period, next_due = entry
+            now = time.ticks_ms()
+            due = time.ticks_diff(next_due, now)
+            if due <= 0:
+                self.rings[addr].push(now, reader())
+                # 落后超过一个周期时重新对齐，避免连续补采
+                entry[2] = time.ticks_add(now if -due >= period else next_due, period)
+                due = time.ticks_diff(entry[2], time.ticks_ms())
+            wait = min(wait, due)
+        ZC_I2C().maybe_rescan()
+        COLOR_CALIBRATION().service()
+        return wait
+
+    def step(self):
+        """采样一轮，返回需要等待的毫秒数，线程和asyncio任务共用"""
+        try:
+            wait = self.sample_due()
+        except Exception as e:
+            print(f"传感器采样错误: {e}")
+            wait = 100
+        return max(1, wait)
+
+    def run(self):
+        try:
+            while self.running:
+                time.sleep_ms(self.step())
+        finally:
+            self.alive = False
+
+
+def start_sampler():
+    sampler = SENSOR_SAMPLER()
+    if sampler.running:
+        return
+    sampler.running = True
+    if not sampler.alive:
+        sampler.alive = True  # 启动前置位，避免线程开始运行前重复启动
+        _thread.start_new_thread(sampler.run, ())
+
+
+def stop_sampler():
+    SENSOR_SAMPLER().running = False
+
+
+def set_sample_period(addr, period_ms):
+    if not isinstance(period_ms, int) or period_ms < 1:
+        raise ValueError("period_ms需为大于0的int整型")
+    sampler = SENSOR_SAMPLER()
+    if addr not in sampler.devices:
+        raise ValueError("未知的传感器地址")
+    SAMPLE_PERIOD_MS[addr] = period_ms
+    sampler.devices[addr][1] = period_ms
+    sampler.devices[addr][2] = time.ticks_ms()
 
 
+def sensor_ring(addr):
+    return SENSOR_SAMPLER().rings[addr]